@@ -0,0 +1,53 @@
+"""
+compares the memory used per interview by the slotted tsapi model
+against the same classes with a per-instance __dict__, as they were
+before __slots__ was added.
+
+python benchmarks/interview_memory.py [interviews] [data items]
+"""
+import sys
+import tracemalloc
+
+import tsapiness.tsapi as ts
+
+
+def with_dict(cls):
+    # a subclass without __slots__ gets a __dict__ again
+    return type(f'{cls.__name__}WithDict', (cls,), {})
+
+
+def build(interview_cls, data_item_cls, interviews, data_items):
+    survey = []
+    for row in range(interviews):
+        iv = interview_cls(ident=row, date=None, complete=True)
+        iv.data_items = [data_item_cls(ident=f'Q{n}', values=[str(n)])
+                         for n in range(data_items)]
+        survey.append(iv)
+    return survey
+
+
+def measure(interview_cls, data_item_cls, interviews, data_items) -> float:
+    tracemalloc.start()
+    survey = build(interview_cls, data_item_cls, interviews, data_items)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del survey
+    return size / interviews
+
+
+def main():
+    interviews = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    data_items = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    slotted = measure(ts.Interview, ts.DataItem, interviews, data_items)
+    plain = measure(with_dict(ts.Interview), with_dict(ts.DataItem),
+                    interviews, data_items)
+
+    print(f'{interviews} interviews x {data_items} data items')
+    print(f'with __dict__: {plain:10.0f} bytes per interview')
+    print(f'with __slots__:{slotted:10.0f} bytes per interview')
+    print(f'saving:        {1 - slotted / plain:10.1%}')
+
+
+if __name__ == '__main__':
+    main()
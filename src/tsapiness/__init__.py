@@ -1,7 +1,10 @@
 import tsapiness.tsapi
+import tsapiness.connector_base
 import tsapiness.connector_tsapi
 import tsapiness.connector_sss
 import tsapiness.connector_sav
+import tsapiness.export
+import tsapiness.snapshot
 
 
 
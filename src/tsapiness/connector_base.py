@@ -0,0 +1,59 @@
+import tsapiness.tsapi as ts
+import tsapiness.snapshot as snapshot
+
+
+class BaseSurvey:
+    """
+    what the Survey of every connector shares. a connector keeps its
+    metadata and interviews behind the metadata and interviews
+    properties, the interviews in _interviews once they are read, and
+    overrides the _snapshot hooks where its metadata or columns differ
+    from the tsapi ones.
+    """
+
+    def iter_interviews(self):
+        """
+        yields the interviews without keeping them on the survey
+        """
+        yield from self.interviews
+
+    def load(self):
+        """
+        reads the metadata and every interview into memory
+        """
+        self.metadata
+        self.interviews = list(self.interviews)
+        return self
+
+    def save_snapshot(self, directory) -> int:
+        """
+        writes the metadata and the interviews column-wise to a snapshot
+        directory, see tsapiness.snapshot
+        :return: number of interviews written
+        """
+        interviews = self._interviews
+        if not isinstance(interviews, (list, ts.ColumnarInterviews)):
+            interviews = self._snapshot_interviews()
+        return snapshot.save(directory, self._snapshot_metadata(),
+                             interviews)
+
+    def load_snapshot(self, directory, memory_map=True):
+        """
+        takes the metadata and interviews from a snapshot directory
+        written by save_snapshot instead of the survey's source
+        :param memory_map: map the column files rather than read them
+        """
+        metadata, self.interviews = snapshot.load(directory,
+                                                  memory_map=memory_map)
+        self._restore_metadata(metadata)
+        return self
+
+    def _snapshot_metadata(self) -> ts.SurveyMetadata:
+        return self.metadata
+
+    def _snapshot_interviews(self) -> ts.ColumnarInterviews:
+        # the interviews that have not been read yet
+        return self.get_columnar()
+
+    def _restore_metadata(self, metadata: ts.SurveyMetadata):
+        self.metadata = metadata
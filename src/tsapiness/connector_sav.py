@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 import pyreadstat
 
 import tsapiness.tsapi as ts
+import tsapiness.connector_base as cb
 
 
 class Connection:
@@ -9,45 +11,203 @@ class Connection:
         self.sav_file = sav_file
 
 
-class Survey:
+class Survey(cb.BaseSurvey):
 
-    def __init__(self, connection: Connection, id_var: str, date_var: str):
+    def __init__(self, connection: Connection, id_var: str, date_var: str,
+                 variables: list = None, chunksize: int = None,
+                 metadata_only: bool = False, ranges: str = 'data'):
+        """
+        :param chunksize: stream the interviews from the sav file this
+        many rows at a time instead of loading the whole file
+        :param metadata_only: only read the sav metadata, no interviews
+        :param ranges: where variable value ranges come from, 'data' for
+        the min/max of the numeric data (the default, reading metadata
+        then loads the data), 'labels' for the min/max of the value
+        label codes in the sav metadata, None to skip them. 'labels' and
+        None read the metadata without the data
+        """
         self.id_variable = id_var
         self.date_variable = date_var
+        self.variables = variables
+        self.chunksize = chunksize
+        self.metadata_only = metadata_only
+        self.ranges = ranges
+        self._value_ranges = None
         self.connection = connection
-        self.data, self.meta = pyreadstat.read_sav(self.connection.sav_file)
-        self.metadata = self.get_metadata(self.meta)
-        self.interviews = self.get_interviews(self.data)
+        # nothing is read from the sav file until it is first needed
+        self._data = None
+        self._meta = None
+        self._metadata = None
+        self._interviews = None
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """
+        the full sav data, None when streaming or reading metadata only
+        """
+        if self._data is None and not (self.chunksize or
+                                       self.metadata_only):
+            self._data, self._meta = pyreadstat.read_sav(
+                self.connection.sav_file, usecols=self.usecols)
+        return self._data
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            _, self._meta = pyreadstat.read_sav(self.connection.sav_file,
+                                                metadataonly=True,
+                                                usecols=self.usecols)
+        return self._meta
+
+    @property
+    def metadata(self) -> ts.SurveyMetadata:
+        """
+        built on first access from the sav metadata alone, unless value
+        ranges come from the data (ranges='data'), which loads it
+        """
+        if self._metadata is None:
+            self._metadata = self.get_metadata(self.meta)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
+    @property
+    def interviews(self):
+        """
+        built on first access, a re-iterable Interviews object when
+        streaming, otherwise the list of every interview
+        """
+        if self._interviews is None:
+            if self.metadata_only:
+                self._interviews = []
+            elif self.chunksize:
+                self._interviews = Interviews(survey=self,
+                                              chunksize=self.chunksize)
+            else:
+                self._interviews = self.get_interviews(self.data)
+        return self._interviews
+
+    @interviews.setter
+    def interviews(self, interviews):
+        self._interviews = interviews
+
+    def iter_interviews(self):
+        """
+        yields the interviews without keeping them on the survey
+        """
+        if self._interviews is not None:
+            yield from self._interviews
+        elif self.metadata_only:
+            return
+        elif self.chunksize:
+            yield from Interviews(survey=self, chunksize=self.chunksize)
+        else:
+            yield from self.get_interviews(self.data)
+
+    @property
+    def usecols(self):
+        """
+        columns to read from the sav file, the id and date variables are
+        always read so the interviews can be identified
+        """
+        if self.variables is None:
+            return None
+        cols = [self.id_variable, self.date_variable] + list(self.variables)
+        return list(dict.fromkeys(cols))
 
     def check_range(self, vi):
-        d = self.data[vi]
+        if self._value_ranges is None:
+            self._value_ranges = self.get_value_ranges()
+        return self._value_ranges.get(vi)
 
-        v_max = d.values.max()
-        v_min = d.values.min()
-        value_range_dict = {'from': v_min, 'to': v_max}
-        _r = ts.ValueRange(**value_range_dict)
-        return _r
+    def get_value_ranges(self) -> dict:
+        """
+        computes the value range of every variable in one pass
+        :return: dict of variable ident to ValueRange
+        """
+        if self.ranges == 'labels':
+            return {vi: ts.ValueRange(**{'from': min(labels),
+                                         'to': max(labels)})
+                    for vi, labels in self.meta.variable_value_labels.items()
+                    if labels}
+        if self.ranges != 'data' or self.data is None:
+            # ranges from the data need it loaded, which it is not when
+            # streaming or reading metadata only
+            return {}
+        stats = self.data.select_dtypes('number').agg(['min', 'max'])
+        return {vi: ts.ValueRange(**{'from': stats.at['min', vi],
+                                     'to': stats.at['max', vi]})
+                for vi in stats.columns}
+
+    def get_interviews(self, data: pd.DataFrame) -> list:
+        """
+        builds the interviews column-wise: each column and its missing
+        value mask are converted to lists of python values in a single
+        pass, every row then picks its values out of those lists
+        """
+        names = list(data.columns)
+        if self.variables is not None:
+            keep = set(self.variables)
+            names = [name for name in names if name in keep]
+
+        idents = data[self.id_variable].tolist()
+        dates = data[self.date_variable].tolist()
+        columns = [(name, data[name].tolist(), data[name].notna().tolist())
+                   for name in names]
 
-    def get_interviews(self, data):
         interviews = []
-        raw_interview = pd.DataFrame(data)
-
-        for index, row in raw_interview.iterrows():
-            _dict = {'ident': row[self.id_variable],
-                     'date': row[self.date_variable],
-                     'complete': True,
-                     'dataItems': []}
-            interview = ts.Interview(**_dict)
-
-            for name, value in row.iteritems():
-                if not pd.isna(value):
-                    di = ts.DataItem(ident=name, values=[value])
-                    interview.data_items.append(di)
+        for row, (ident, date) in enumerate(zip(idents, dates)):
+            interview = ts.Interview(ident=ident, date=date, complete=True)
+            interview.data_items = [
+                ts.DataItem(ident=name, values=[values[row]])
+                for name, values, present in columns if present[row]]
             interviews.append(interview)
 
         return interviews
 
+    def get_columnar(self) -> ts.ColumnarInterviews:
+        """
+        the sav data as a ColumnarInterviews store, filled straight from
+        the data frame columns. when streaming the arrays of each chunk
+        are collected and joined per column, the chunks are never put
+        together into one data frame. empty when reading metadata only.
+        """
+        if self.metadata_only:
+            return ts.ColumnarInterviews(idents=np.array([]))
+        if self.data is not None:
+            frames = [self.data]
+        else:
+            frames = (data for data, _ in pyreadstat.read_file_in_chunks(
+                pyreadstat.read_sav,
+                self.connection.sav_file,
+                chunksize=self.chunksize,
+                usecols=self.usecols))
+
+        idents = []
+        dates = []
+        columns = {}
+        for data in frames:
+            names = list(data.columns)
+            if self.variables is not None:
+                keep = set(self.variables)
+                names = [name for name in names if name in keep]
+            idents.append(data[self.id_variable].to_numpy())
+            dates.append(data[self.date_variable].to_numpy())
+            for name in names:
+                columns.setdefault(name, []).append(data[name].to_numpy())
+
+        def join(arrays: list) -> np.ndarray:
+            return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+        if not idents:
+            return ts.ColumnarInterviews(idents=np.array([]))
+        return ts.ColumnarInterviews(
+            idents=join(idents),
+            dates=join(dates),
+            columns={name: join(arrays) for name, arrays in columns.items()})
+
     def get_metadata(self, data):
 
         s_name = str(self.connection.sav_file).split('\\')[-1]
@@ -94,4 +254,20 @@ class Survey:
         return v_list
 
 
+class Interviews:
+    """
+    re-iterable view over the interviews of a sav file, the file is read
+    chunksize rows at a time so at most one chunk is held in memory
+    """
+    def __init__(self, survey: Survey, chunksize: int):
+        self.survey = survey
+        self.chunksize = chunksize
 
+    def __iter__(self):
+        chunks = pyreadstat.read_file_in_chunks(
+            pyreadstat.read_sav,
+            self.survey.connection.sav_file,
+            chunksize=self.chunksize,
+            usecols=self.survey.usecols)
+        for data, _ in chunks:
+            yield from self.survey.get_interviews(data)
@@ -1,65 +1,490 @@
+import io
+import mmap
+import os
 import xml.etree.ElementTree as et
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
 import tsapiness.tsapi as ts
+import tsapiness.connector_base as cb
+
+NUMERIC_TYPES = ('single', 'multiple', 'quantity', 'logical')
+# a multiple without a spread is a bit string, e.g. '0101', one
+# character per value, not a number
+SPREAD_TYPES = ('multiple',)
 
 
 class Connection:
-    def __init__(self, asc_file: str, sss_file: str):
+    def __init__(self, asc_file: str, sss_file: str,
+                 memory_map: bool = False, encoding: str = 'utf-8'):
+        """
+        :param memory_map: read the asc file through mmap, each interview
+        keeps a memoryview of its line which is only cut into fields and
+        decoded with encoding when its data items are read
+        """
         self.asc_file = asc_file
         self.sss_file = sss_file
+        self.memory_map = memory_map
+        self.encoding = encoding
 
 
-class Survey:
+class Survey(cb.BaseSurvey):
 
-    def __init__(self, connection: Connection):
+    def __init__(self, connection: Connection, iterparse: bool = False,
+                 workers: int = 1, variables: list = None):
+        """
+        :param variables: idents of the variables to read, all variables
+        are read when None
+        """
         self.connection = connection
-        self.metadata = SurveyMetaData(self.connection.sss_file)
-        self.interviews = self.get_interviews(self.connection.asc_file)
+        self.iterparse = iterparse
+        self.workers = workers
+        self.variables = variables
+        # nothing is read from the sss or asc file until first needed
+        self._metadata = None
+        self._slicing_plan = None
+        self._interviews = None
 
-    def get_interviews(self, file: str) -> list:
-        interviews = []
-        with open(file) as f:
-            lines = f.readlines()
-            count_row_id = 0
+    @property
+    def metadata(self) -> 'SurveyMetaData':
+        if self._metadata is None:
+            self._metadata = SurveyMetaData(self.connection.sss_file,
+                                            iterparse=self.iterparse)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+        self._slicing_plan = None
 
-            for line in lines:
-                # create Interview
+    @property
+    def slicing_plan(self) -> 'SlicingPlan':
+        if self._slicing_plan is None:
+            self._slicing_plan = self.metadata.slicing_plan
+            if self.variables is not None:
+                self._slicing_plan = SlicingPlan(
+                    self.metadata.variable_positions,
+                    variables=self.variables)
+        return self._slicing_plan
+
+    @property
+    def interviews(self):
+        """
+        a re-iterable Interviews object, or the list of interviews once
+        load() has been called
+        """
+        if self._interviews is None:
+            self._interviews = self.get_interviews(self.connection.asc_file)
+        return self._interviews
+
+    @interviews.setter
+    def interviews(self, interviews):
+        self._interviews = interviews
+
+    def _snapshot_metadata(self) -> ts.SurveyMetadata:
+        return self.metadata.survey
+
+    def _snapshot_interviews(self) -> ts.ColumnarInterviews:
+        # the fields are kept as the text of the asc file, so the
+        # snapshot holds the same values as survey.interviews
+        records = _read_records(self.connection.asc_file)
+        if records is None:
+            # records of different lengths, e.g. with trailing blanks
+            # trimmed, are only read line by line
+            return ts.ColumnarInterviews.from_interviews(self.interviews)
+        return _columnar(read_columns(file=self.connection.asc_file,
+                                      metadata=self.metadata,
+                                      encoding=self.connection.encoding,
+                                      plan=self.slicing_plan,
+                                      as_text=True,
+                                      records=records))
+
+    def _restore_metadata(self, metadata: ts.SurveyMetadata):
+        # there is no schema file behind the metadata of a snapshot
+        self.metadata = SurveyMetaData.from_survey(metadata)
+
+    def get_interviews(self, file: str) -> 'Interviews':
+        return Interviews(file=file, plan=self.slicing_plan,
+                          workers=self.workers,
+                          memory_map=self.connection.memory_map,
+                          encoding=self.connection.encoding)
+
+    def get_columns(self, encoding: str = 'utf-8',
+                    as_text: bool = False) -> dict:
+        """
+        decodes the asc file column-wise without building interviews
+        :param as_text: keep every field as its text, see read_columns
+        :return: dict of variable ident to numpy array
+        """
+        return read_columns(file=self.connection.asc_file,
+                            metadata=self.metadata,
+                            encoding=encoding,
+                            plan=self.slicing_plan,
+                            as_text=as_text)
+
+    def get_columnar(self, encoding: str = 'utf-8',
+                     as_text: bool = False) -> ts.ColumnarInterviews:
+        """
+        the decoded columns as a ColumnarInterviews store, interviews are
+        identified by their row number as in get_interviews
+        :param as_text: keep every field as its text, see read_columns
+        """
+        return _columnar(self.get_columns(encoding=encoding,
+                                          as_text=as_text))
+
+    def to_dataframe(self, encoding: str = 'utf-8') -> pd.DataFrame:
+        """
+        columnar view of the asc file, variables with subfields are
+        expanded to one column per subfield named ident_1, ident_2...
+        :return: DataFrame
+        """
+        frame = {}
+        for ident, column in self.get_columns(encoding=encoding).items():
+            if column.ndim == 2:
+                for n in range(column.shape[1]):
+                    frame[f'{ident}_{n + 1}'] = column[:, n]
+            else:
+                frame[ident] = column
+        return pd.DataFrame(frame)
+
+
+class Interviews:
+    """
+    re-iterable view over the interviews in a triple-s asc file.
+    the file is read line by line on every iteration so only the
+    current record is held in memory.
+    with workers > 1 the file is split into line aligned byte ranges of
+    about chunk_size bytes which are cut into fields in a process pool.
+    each chunk comes back as one structured array of fields, the
+    interviews are yielded in file order and build their data items
+    when they are first read.
+    with memory_map the file is mapped rather than read and each
+    interview holds a memoryview of its line, which is cut and decoded
+    on first access. it reads the file in this process so it cannot be
+    combined with workers.
+    """
+    def __init__(self, file: str, plan: 'SlicingPlan',
+                 workers: int = 1, chunk_size: int = 2 ** 20,
+                 memory_map: bool = False, encoding: str = 'utf-8'):
+        if memory_map and workers > 1:
+            raise ValueError('memory_map cannot be combined with workers')
+        self.file = file
+        self.plan = plan
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.memory_map = memory_map
+        self.encoding = encoding
+
+    def __iter__(self):
+        if self.workers > 1:
+            yield from self._iter_parallel()
+            return
+        if self.memory_map:
+            yield from self._iter_mapped()
+            return
+        with open(self.file) as f:
+            count_row_id = 0
+            for line in f:
                 count_row_id += 1
-                i = {'ident': count_row_id,
-                     'date': None,
-                     'complete': True,
-                     'dataItems': []
-                     }
-                iv = ts.Interview(**i)
-
-                # populate dataitems
-                for loc in self.metadata.variable_positions:
-                    start = 0
-                    finish = 0
-                    subfields = 0
-                    width = 0
-
-                    start = int(loc['start']) - 1
-                    finish = int(loc['finish'])
-                    if 'subfields' in loc.keys():
-                        subfields = int(loc['subfields'])
-                    else:
-                        subfields = 0
-                    if 'width' in loc.keys():
-                        width = int(loc['width'])
-                    else:
-                        width = 0
-                    datapoint = line[start:finish]
-                    datapoints = []
-                    if subfields > 0:
-                        datapoints = [datapoint[i:i + width] for i in
-                                      range(0, len(datapoint), width)]
-                    else:
-                        datapoints.append(datapoint)
-
-                    di = ts.DataItem(ident=loc['ident'], values=datapoints)
-                    iv.data_items.append(di)
-                interviews.append(iv)
-        return interviews
+                yield self.get_interview(line, count_row_id)
+
+    def _iter_parallel(self):
+        plan = self.plan
+        chunks = iter(_get_chunks(self.file, self.chunk_size))
+        count_row_id = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # keep a bounded window of chunks in flight so memory stays
+            # proportional to the number of workers, not the file size
+            pending = deque()
+            for start, end in islice(chunks, self.workers * 2):
+                pending.append(executor.submit(
+                    _parse_chunk, self.file, start, end, plan))
+            while pending:
+                records = pending.popleft().result()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(executor.submit(
+                        _parse_chunk, self.file, *chunk, plan))
+                for record in records:
+                    count_row_id += 1
+                    yield _record_interview(count_row_id, record, plan)
+
+    def _iter_mapped(self):
+        if os.path.getsize(self.file) == 0:
+            return
+        with open(self.file, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # the map is closed by garbage collection once no interview
+        # holds a slice of it any more
+        view = memoryview(mapped)
+        plan = self.plan
+        size = len(mapped)
+        count_row_id = 0
+        start = 0
+        while start < size:
+            end = mapped.find(b'\n', start) + 1 or size
+            count_row_id += 1
+            iv = _record_interview(count_row_id, view[start:end], plan,
+                                   cls=MappedInterview)
+            iv._encoding = self.encoding
+            yield iv
+            start = end
+
+    def get_interview(self, line: str, row_id: int) -> ts.Interview:
+        return _get_interview(line, row_id, self.plan)
+
+
+class RecordInterview(ts.Interview):
+    """
+    interview over one record of the asc file whose data items are only
+    built the first time data_items is read. the record is a row of the
+    structured array of fields a worker cut with the slicing plan.
+    """
+    __slots__ = ('_record', '_plan', '_data_items')
+
+    def _fields(self) -> tuple:
+        return self._record.tolist()
+
+    @property
+    def data_items(self) -> list:
+        if self._data_items is None:
+            self._data_items = [
+                ts.DataItem(ident=ident, values=values)
+                for ident, values in self._plan.group(self._fields())]
+            self._record = None
+        return self._data_items
+
+    @data_items.setter
+    def data_items(self, data_items):
+        self._data_items = data_items
+        self._record = None
+
+
+class MappedInterview(RecordInterview):
+    """
+    RecordInterview whose record is a memoryview of its line in a mapped
+    asc file, the fields are decoded with encoding when they are cut
+    """
+    __slots__ = ('_encoding',)
+
+    def _fields(self) -> tuple:
+        encoding = self._encoding
+        record = self._record
+        if record[-2:] == b'\r\n':
+            # cut the line as the text path reads it, universal newlines
+            # turn its \r\n into \n
+            record = bytes(record[:-2]) + b'\n'
+        return tuple(str(v, encoding) for v in self._plan.cut(record))
+
+
+def _record_interview(row_id: int, record, plan: 'SlicingPlan',
+                      cls=RecordInterview) -> RecordInterview:
+    iv = cls.__new__(cls)
+    iv._record = record
+    iv._plan = plan
+    iv._data_items = None
+    iv.ident = row_id
+    iv.date = None
+    iv.complete = True
+    iv.hierarchical_interviews = []
+    iv._index = None
+    iv._index_key = None
+    return iv
+
+
+def _get_interview(line: str, row_id: int,
+                   plan: 'SlicingPlan') -> ts.Interview:
+    # create Interview
+    i = {'ident': row_id,
+         'date': None,
+         'complete': True,
+         'dataItems': []
+         }
+    iv = ts.Interview(**i)
+
+    # populate dataitems
+    for ident, values in plan.split(line):
+        di = ts.DataItem(ident=ident, values=values)
+        iv.data_items.append(di)
+    return iv
+
+
+def _get_chunks(file: str, chunk_size: int) -> list:
+    """
+    splits the file into byte ranges that start and end on line breaks
+    :return: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(file)
+    chunks = []
+    with open(file, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = f.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _parse_chunk(file: str, start: int, end: int,
+                 plan: 'SlicingPlan') -> list:
+    """
+    cuts one byte range of the asc file into the fields of the slicing
+    plan, one row of a structured array per line. the array pickles
+    back to the parent as a single buffer, where Interview and DataItem
+    objects cost more to pickle and unpickle than to parse.
+    """
+    with open(file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # decode the same way open() does in text mode
+    lines = io.TextIOWrapper(io.BytesIO(data))
+    return np.array([plan.cut(line) for line in lines], dtype=plan.dtype)
+
+
+class SlicingPlan:
+    """
+    fixed slicing plan compiled once from the variable positions.
+    every field (or subfield) gets precomputed start/finish offsets and
+    a single itemgetter cuts all of them out of a line in one call.
+    when variables is given only those idents are part of the plan.
+    """
+    def __init__(self, variable_positions: list, variables: list = None):
+        self.bounds = []
+        self.layout = []
+        if variables is not None:
+            variables = set(variables)
+
+        for loc in variable_positions:
+            if variables is not None and loc['ident'] not in variables:
+                continue
+            start = int(loc['start']) - 1
+            finish = int(loc['finish'])
+            subfields = int(loc.get('subfields', 0))
+            width = int(loc.get('width', 0))
+
+            first = len(self.bounds)
+            if subfields > 0:
+                self.bounds += [(i, min(i + width, finish))
+                                for i in range(start, finish, width)]
+            else:
+                self.bounds.append((start, finish))
+            self.layout.append((loc['ident'], first, len(self.bounds)))
+
+        slices = [slice(start, finish) for start, finish in self.bounds]
+        while len(slices) < 2:
+            # itemgetter with a single item does not return a tuple
+            slices.append(slice(0, 0))
+        self._getter = itemgetter(*slices)
+        # one fixed width str field per slice, for arrays of cut lines
+        self.dtype = np.dtype([(f'f{n}', f'U{max(s.stop - s.start, 1)}')
+                               for n, s in enumerate(slices)])
+
+    def cut(self, line) -> tuple:
+        """
+        all fields of the line, in the order of bounds
+        """
+        return self._getter(line)
+
+    def group(self, fields):
+        """
+        yields (ident, values) for each variable from the fields of cut
+        """
+        for ident, first, last in self.layout:
+            yield ident, fields[first:last]
+
+    def split(self, line):
+        """
+        yields (ident, values) for each variable of the line
+        """
+        return self.group(self._getter(line))
+
+
+def _columnar(columns: dict) -> ts.ColumnarInterviews:
+    rows = len(next(iter(columns.values()))) if columns else 0
+    return ts.ColumnarInterviews(idents=np.arange(1, rows + 1),
+                                 columns=columns)
+
+
+def _decode_column(column: np.ndarray, v_type: str, encoding: str,
+                   spread: bool = False) -> np.ndarray:
+    if v_type in NUMERIC_TYPES and (spread or v_type not in SPREAD_TYPES):
+        column = np.char.strip(column)
+        return np.where(column == b'', b'nan', column).astype(np.float64)
+    return np.char.decode(column, encoding)
+
+
+def _read_records(file: str):
+    """
+    reads the asc file as a byte matrix, one row per record with its
+    line terminator
+    :return: numpy array, None when the records are not all the same
+    length
+    """
+    with open(file, 'rb') as f:
+        raw = f.read()
+
+    terminator = b'\r\n' if b'\r\n' in raw[:raw.find(b'\n') + 1] else b'\n'
+    if raw and not raw.endswith(b'\n'):
+        # the last record is often written without a line terminator
+        raw += terminator
+    line_length = raw.find(b'\n') + 1 or 1
+    if len(raw) % line_length:
+        return None
+    matrix = np.frombuffer(raw, dtype=np.uint8).reshape(-1, line_length)
+    if len(matrix) and not (matrix[:, -1] == ord('\n')).all():
+        return None
+    return matrix
+
+
+def read_columns(file: str, metadata: 'SurveyMetaData',
+                 encoding: str = 'utf-8', plan: SlicingPlan = None,
+                 as_text: bool = False, records=None) -> dict:
+    """
+    reads the fixed width asc file as a byte matrix, one row per record,
+    and slices whole columns at once using the slicing plan.
+    numeric variables become float arrays with nan for blanks, anything
+    else is decoded to a str array, as are multiples without a spread,
+    which are bit strings. variables with subfields become a
+    two dimensional array of records by subfields.
+    :param as_text: decode every field to a str array, blanks and
+    padding included, the values the interviews of the file hold
+    :param records: the byte matrix of the file when it has already been
+    read with _read_records
+    :return: dict of variable ident to numpy array
+    :raises ValueError: when the records are not all the same length
+    """
+    matrix = _read_records(file) if records is None else records
+    if matrix is None:
+        raise ValueError(f'{file} does not hold fixed length records')
+
+    types = {v.ident: v.type for v in metadata.survey.variables}
+    spread = {loc['ident'] for loc in metadata.variable_positions
+              if int(loc.get('subfields', 0)) > 0}
+    plan = plan or metadata.slicing_plan
+
+    columns = {}
+    for ident, first, last in plan.layout:
+        fields = []
+        for start, finish in plan.bounds[first:last]:
+            field = np.ascontiguousarray(matrix[:, start:finish])
+            field = field.view(f'S{field.shape[1]}').ravel() \
+                if field.shape[1] else np.zeros(len(matrix), dtype='S1')
+            if as_text:
+                fields.append(np.char.decode(field, encoding))
+            else:
+                fields.append(_decode_column(field, types.get(ident),
+                                             encoding,
+                                             spread=ident in spread))
+        columns[ident] = fields[0] if last - first == 1 \
+            else np.stack(fields, axis=1)
+    return columns
 
 
 def _get_node_attrib(item, attribute, if_none):
@@ -70,25 +495,75 @@ def _get_node_attrib(item, attribute, if_none):
 
 
 class SurveyMetaData:
-    def __init__(self, file: str):
+    def __init__(self, file: str, iterparse: bool = False):
         self.file = file
-        self.tree = et.parse(self.file)
-        self.survey = self.get_survey()
-        self.variable_positions = self._get_variable_position()
+        self.tree = None
+        if iterparse:
+            self.survey, self.variable_positions = self._iterparse()
+        else:
+            self.tree = et.parse(self.file)
+            self.survey = self.get_survey()
+            self.variable_positions = self._get_variable_position()
+        self.slicing_plan = SlicingPlan(self.variable_positions)
+
+    @classmethod
+    def from_survey(cls, survey: ts.SurveyMetadata) -> 'SurveyMetaData':
+        """
+        wraps already converted metadata, e.g. from a snapshot. there is
+        no schema file behind it and so no asc file positions
+        """
+        _m = cls.__new__(cls)
+        _m.file = None
+        _m.tree = None
+        _m.survey = survey
+        _m.variable_positions = []
+        _m.slicing_plan = SlicingPlan(_m.variable_positions)
+        return _m
 
     @property
     def xml_tree(self) -> et.ElementTree:
         """
-        converts the xml schema into an xml ElementTree object
+        converts the xml schema into an xml ElementTree object,
+        the file is parsed once and kept on self.tree
         :return: ElementTree
         """
-        tree = et.parse(self.file)
-        return tree
+        if self.tree is None:
+            self.tree = et.parse(self.file)
+        return self.tree
 
     def _root(self):
         _root = self.xml_tree.getroot()
         return _root
 
+    def _iterparse(self) -> tuple:
+        """
+        single streaming pass over the schema for very large files,
+        each variable node is cleared once read so the full tree is
+        never held in memory
+        :return: SurveyMetadata, variable positions
+        """
+        s_name = ''
+        s_title = ''
+        variables = []
+        positions = []
+        path = []
+        for event, node in et.iterparse(self.file, events=('start', 'end')):
+            if event == 'start':
+                path.append(node.tag)
+                continue
+            path.pop()
+            if node.tag == 'variable':
+                variables.append(self.get_variable(node))
+                positions.append(self.get_variable_position(node))
+                node.clear()
+            elif path[1:] == ['survey'] and node.tag == 'name':
+                s_name = node.text
+            elif path[1:] == ['survey'] and node.tag == 'title':
+                s_title = node.text
+        _s = ts.SurveyMetadata(name=s_name, title=s_title)
+        _s.variables = variables
+        return _s, positions
+
     def get_value(self, node):
         v_ident = _get_node_attrib(node, 'ident', "")
         v_code = _get_node_attrib(node, 'code', "")
@@ -144,47 +619,46 @@ class SurveyMetaData:
 
     def _get_variable_position(self) -> list:
         variable_nodes = self._root().iter('variable')
-        v_list = []
-        for var in variable_nodes:
-            v_ident = _get_node_attrib(var, 'ident', "")
-            v_pos = {}
-            v_spread = {}
-            v_size = 0
-
-            for attr in var:
-                v_pos = attr.attrib if attr.tag == 'position' else v_pos
-                v_spread = attr.attrib if attr.tag == 'spread' else v_spread
-                v_size = attr.attrib if attr.tag == 'size' else v_size
-            v_data_location = {'ident': v_ident}
-            v_data_location.update(v_pos)
-            v_data_location.update(v_spread)
-            if v_size > 0:
-                v_data_location.update({'size': v_size})
-            v_list.append(v_data_location)
-        return v_list
+        return [self.get_variable_position(var) for var in variable_nodes]
+
+    def get_variable_position(self, var) -> dict:
+        v_ident = _get_node_attrib(var, 'ident', "")
+        v_pos = {}
+        v_spread = {}
+        v_size = 0
+
+        for attr in var:
+            v_pos = attr.attrib if attr.tag == 'position' else v_pos
+            v_spread = attr.attrib if attr.tag == 'spread' else v_spread
+            v_size = attr.attrib if attr.tag == 'size' else v_size
+        v_data_location = {'ident': v_ident}
+        v_data_location.update(v_pos)
+        v_data_location.update(v_spread)
+        if v_size > 0:
+            v_data_location.update({'size': v_size})
+        return v_data_location
 
     def _get_variable(self) -> list:
         variable_nodes = self._root().iter('variable')
-        v_list = []
-        for var in variable_nodes:
-            v_ident = _get_node_attrib(var, 'ident', "")
-            v_type = _get_node_attrib(var, 'type', "")
-            v_use = _get_node_attrib(var, 'use', "")
-            v_label = ""
-            v_name = ""
-            v_values = None
-
-            for attr in var:
-                v_label = attr.text if attr.tag == 'label' else v_label
-                v_name = attr.text if attr.tag == 'name' else v_name
-                v_values = self.get_variable_values(
-                    attr) if attr.tag == 'values' else v_values
-
-            v_label = {'text': v_label}
-            _v = ts.Variable(ident=v_ident, type=v_type, use=v_use,
-                             label=v_label, name=v_name)
-
-            _v.variable_values = v_values
-            v_list.append(_v)
-        return v_list
+        return [self.get_variable(var) for var in variable_nodes]
+
+    def get_variable(self, var) -> ts.Variable:
+        v_ident = _get_node_attrib(var, 'ident', "")
+        v_type = _get_node_attrib(var, 'type', "")
+        v_use = _get_node_attrib(var, 'use', "")
+        v_label = ""
+        v_name = ""
+        v_values = None
+
+        for attr in var:
+            v_label = attr.text if attr.tag == 'label' else v_label
+            v_name = attr.text if attr.tag == 'name' else v_name
+            v_values = self.get_variable_values(
+                attr) if attr.tag == 'values' else v_values
 
+        v_label = {'text': v_label}
+        _v = ts.Variable(ident=v_ident, type=v_type, use=v_use,
+                         label=v_label, name=v_name)
+
+        _v.variable_values = v_values
+        return _v
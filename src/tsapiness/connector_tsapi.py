@@ -1,11 +1,287 @@
+import asyncio
+import codecs
+import hashlib
 import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 import tsapiness.tsapi as ts
+import tsapiness.connector_base as cb
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+DEFAULT_DATE = '2022-06-01T13:19:58.293Z'
+STREAM_CHUNK_SIZE = 2 ** 16
+NUMBER_CHARS = '0123456789+-.eE'
+STORE_BLOCK_SIZE = 2 ** 16
+# cache entries have a suffix of their own, eviction never touches
+# other files in the cache directory
+CACHE_SUFFIX = '.response.json'
+
+
+def iter_json_array(chunks):
+    """
+    yields the items of a json array one at a time from an iterable of
+    utf8 encoded byte chunks, only the item being decoded is buffered
+    :raises ValueError: when the chunks are not a complete json array,
+    e.g. a response cut off before its closing ']'
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf8')()
+    buffer = ''
+    started = False
+    # after an item a ',' or the closing ']' has to come next
+    separator = False
+    comma = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('expected a json array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']' and not comma:
+                return
+            if separator:
+                if buffer[pos] != ',':
+                    raise ValueError('invalid json array')
+                separator = False
+                comma = True
+                pos += 1
+                continue
+            if buffer[pos] in ',]':
+                raise ValueError('invalid json array')
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the item is not complete yet
+                break
+            after = end
+            while after < len(buffer) and buffer[after] in ' \t\r\n':
+                after += 1
+            if after == len(buffer):
+                # a number may carry on in the next chunk
+                break
+            if buffer[after] not in ',]':
+                if isinstance(item, (int, float)) and \
+                        not buffer[end:].strip(NUMBER_CHARS):
+                    # a number cut after its '.', 'e' or sign, the rest
+                    # of it is in the next chunk
+                    break
+                raise ValueError('invalid json array')
+            yield item
+            pos = end
+            separator = True
+            comma = False
+        buffer = buffer[pos:]
+    # the closing ']' returns above, the stream ended before it
+    raise ValueError('json array is not complete')
+
+
+class ResponseCache:
+    """
+    on disk cache of server responses. entries younger than ttl seconds
+    are served without a request, older ones are revalidated with their
+    ETag / Last-Modified headers. once the cache is larger than max_size
+    bytes the least recently used entries are removed.
+    the directory can be shared by several processes, only files ending
+    in CACHE_SUFFIX are counted and evicted.
+    """
+    def __init__(self, directory, ttl=300, max_size=2 ** 28):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        # bytes in the directory as of the last scan plus what this
+        # process wrote since, None until the first scan
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, body=None) -> str:
+        request = json.dumps([method, url, body], sort_keys=True)
+        return hashlib.sha256(request.encode('utf8')).hexdigest()
+
+    def path(self, key) -> str:
+        return os.path.join(self.directory, f'{key}{CACHE_SUFFIX}')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), encoding='utf8') as f:
+                entry = json.load(f)
+            # the file modification time records the last use
+            os.utime(self.path(key))
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry
+
+    def is_fresh(self, entry) -> bool:
+        return time.time() - entry['stored'] < self.ttl
+
+    def put(self, key, r: requests.Response):
+        entry = {'stored': time.time(),
+                 'etag': r.headers.get('ETag'),
+                 'lastModified': r.headers.get('Last-Modified'),
+                 'content': r.text}
+        self.write(key, entry)
+        self.evict()
+
+    def refresh(self, key, entry):
+        entry['stored'] = time.time()
+        self.write(key, entry)
+
+    def write(self, key, entry):
+        # a temporary file unique to this writer, threads and (forked)
+        # processes sharing the directory never write to the same one
+        handle, temp_file = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        with open(handle, 'w', encoding='utf8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        path = self.path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_file, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path) - replaced
+
+    def evict(self):
+        """
+        removes the least recently used entries once the cache is over
+        max_size. the directory is only scanned when the tracked size
+        goes over, entries written by other processes are counted from
+        that scan on. it is trimmed to 90% of max_size so that a full
+        cache is not scanned again on every write.
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+            entries = []
+            for file in os.scandir(self.directory):
+                if file.name.endswith(CACHE_SUFFIX):
+                    stat = file.stat()
+                    entries.append((stat.st_mtime, stat.st_size, file.path))
+            size = sum(entry[1] for entry in entries)
+            if size > self.max_size:
+                for _, file_size, path in sorted(entries):
+                    if size <= self.max_size * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    size -= file_size
+            self._size = size
+
+    @staticmethod
+    def response(entry, url) -> requests.Response:
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        r.encoding = 'utf8'
+        r._content = entry['content'].encode('utf8')
+        return r
 
 
 class Connection:
-    def __init__(self, server):
+    def __init__(self, server, pool_size=10, timeout=30, retries=5,
+                 backoff_factor=0.5, cache: ResponseCache = None):
+        """
+        all requests to the server go through one pooled, keep-alive
+        requests.Session
+        :param pool_size: connections kept open to the server
+        :param timeout: seconds to wait for the server to connect or reply
+        :param retries: retries on connection errors and 429/5xx replies
+        :param backoff_factor: base of the exponential wait between retries
+        :param cache: optional on disk cache of the server responses
+        """
         self.server = server
+        self.timeout = timeout
+        self.cache = cache
+        self.session = self.get_session(pool_size=pool_size,
+                                        retries=retries,
+                                        backoff_factor=backoff_factor)
+
+    @staticmethod
+    def get_session(pool_size, retries, backoff_factor) -> requests.Session:
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS,
+                      # the interviews query is a read only POST
+                      allowed_methods=None,
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        return session
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if self.cache is None or kwargs.get('stream'):
+            r = self.session.request(method, url, **kwargs)
+            r.raise_for_status()
+            return r
+
+        key = self.cache.key(method, url, kwargs.get('json'))
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self.cache.response(entry, url)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['lastModified']:
+            headers['If-Modified-Since'] = entry['lastModified']
+        r = self.session.request(method, url, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            self.cache.refresh(key, entry)
+            return self.cache.response(entry, url)
+        r.raise_for_status()
+        self.cache.put(key, r)
+        return r
+
+
+class AsyncConnection(Connection):
+    def __init__(self, server, concurrency=8, pool_size=10, timeout=30,
+                 retries=5, backoff_factor=0.5, cache: ResponseCache = None):
+        """
+        :param concurrency: maximum number of interview pages requested
+        from the server at the same time
+        """
+        super().__init__(server=server,
+                         pool_size=max(pool_size, concurrency),
+                         timeout=timeout,
+                         retries=retries,
+                         backoff_factor=backoff_factor,
+                         cache=cache)
+        self.concurrency = concurrency
 
 
 class Surveys:
@@ -28,47 +304,388 @@ class Surveys:
         return result
 
     def get_surveys(self):
-        r = requests.get(f'{self.connection.server}/Surveys')
+        r = self.connection.get(f'{self.connection.server}/Surveys')
         a = json.loads(r.text)
         return a
 
 
-class Survey:
-    def __init__(self, survey_id, connection):
+class Survey(cb.BaseSurvey):
+    def __init__(self, survey_id, connection, variables=None,
+                 page_size=100, date=DEFAULT_DATE, stream=False):
+        """
+        :param date: only interviews after this date are requested
+        :param stream: decode each interview page as it is received
+        rather than after the whole response has been read
+        """
+        self.survey_id = survey_id
         self.connection = connection
-        self.metadata = self.get_survey(survey_id)
-        self.interviews = self.get_interviews(survey_id)
+        self.variables = variables
+        self.page_size = page_size
+        self.date = date
+        self.stream = stream
+        # nothing is requested from the server until it is first needed
+        self._metadata = None
+        self._interviews = None
+
+    @property
+    def metadata(self) -> ts.SurveyMetadata:
+        if self._metadata is None:
+            self._metadata = self.get_survey(self.survey_id)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
+    @property
+    def interviews(self):
+        """
+        a re-iterable Interviews object paging through the server, or
+        the list of interviews once load() has been called
+        """
+        if self._interviews is None:
+            self._interviews = self.get_interviews(self.survey_id)
+        return self._interviews
+
+    @interviews.setter
+    def interviews(self, interviews):
+        self._interviews = interviews
 
     def get_survey(self, s_id):
         url = f'{self.connection.server}/Surveys/{s_id}/Metadata'
-        r = requests.get(url)
+        r = self.connection.get(url)
         json_r = json.loads(r.text)
-        survey_obj = ts.SurveyMetadata(**json_r)
+        survey_obj = ts.load_metadata(json_r)
 
         return survey_obj
 
-    def get_interviews(self, s_id):
+    def get_interviews(self, s_id, date=None):
+        return Interviews(survey=self, survey_id=s_id,
+                          page_size=self.page_size, date=date)
+
+    def get_query(self, s_id, start, max_length,
+                  date=None) -> ts.InterviewsQuery:
+        return ts.InterviewsQuery(surveyId=s_id,
+                                  start=start,
+                                  maxLength=max_length,
+                                  completeOnly=True,
+                                  variables=self.variables,
+                                  date=date or self.date)
+
+    def get_page(self, s_id, start, max_length, date=None,
+                 stream=False):
+        """
+        fetches one page of raw interviews from the server
+        :param start: 1 based position of the first interview
+        :param max_length: maximum number of interviews in the page
+        :param date: overrides the survey date filter
+        :param stream: return the response itself, unread
+        :return: list of interview dicts
+        """
         headers = {
             'accept': 'application/json',
             # Already added when you pass json=
             # 'Content-Type': 'application/json',
         }
 
-        json_data = {
-            'surveyId': s_id,
-            'start': 1,
-            'maxLength': 100,
-            'completeOnly': True,
-            'date': '2022-06-01T13:19:58.293Z',
-        }
+        json_data = self.get_query(s_id, start, max_length,
+                                   date=date).to_tsapi()
 
-        r = requests.post(
+        r = self.connection.post(
             f'{self.connection.server}/Surveys/{s_id}/Interviews',
-            headers=headers, json=json_data)
+            headers=headers, json=json_data, stream=stream)
+        if stream:
+            return r
         json_r = json.loads(r.text)
-        interviews = []
-        for interview in json_r:
-            interview_record = ts.Interview(**interview)
-            interviews.append(interview_record)
+        return json_r
+
+    def iter_page(self, s_id, start, max_length, date=None):
+        """
+        yields the raw interviews of one page, when the survey streams
+        each interview is decoded as soon as its bytes have arrived
+        """
+        if not self.stream:
+            yield from self.get_page(s_id, start, max_length, date=date)
+            return
+        with self.get_page(s_id, start, max_length, date=date,
+                           stream=True) as r:
+            yield from iter_json_array(r.iter_content(STREAM_CHUNK_SIZE))
+
+    def get_columnar(self) -> ts.ColumnarInterviews:
+        """
+        pages through the interviews into a ColumnarInterviews store
+        """
+        return ts.ColumnarInterviews.from_interviews(self.interviews)
+
+    def sync(self, store: 'InterviewStore') -> int:
+        """
+        incremental sync, only interviews after the store's high water
+        mark are requested and merged into the store, which is saved
+        :return: number of interviews added or updated
+        """
+        interviews = self.get_interviews(self.survey_id,
+                                         date=store.high_water_mark)
+        count = store.merge(interviews)
+        store.save()
+        return count
+
+
+class Interviews:
+    """
+    re-iterable view over the interviews of a survey on the server.
+    interviews are requested page_size at a time, following start until
+    the server returns a short page, so only one page is held in memory.
+    """
+    def __init__(self, survey: Survey, survey_id, page_size=100,
+                 date=None):
+        self.survey = survey
+        self.survey_id = survey_id
+        self.page_size = page_size
+        self.date = date
+
+    def __iter__(self):
+        start = 1
+        while True:
+            count = 0
+            page = self.survey.iter_page(self.survey_id, start,
+                                         self.page_size, date=self.date)
+            for interview in page:
+                count += 1
+                yield ts.load_interview(interview)
+            if count < self.page_size:
+                return
+            start += count
+
+
+class AsyncSurvey(Survey):
+    """
+    survey whose interview pages are fetched concurrently, see
+    AsyncInterviews
+    """
+    def __init__(self, survey_id, connection: AsyncConnection,
+                 variables=None, page_size=100, date=DEFAULT_DATE):
+        super().__init__(survey_id=survey_id,
+                         connection=connection,
+                         variables=variables,
+                         page_size=page_size,
+                         date=date)
+
+    def get_interviews(self, s_id, date=None):
+        return AsyncInterviews(survey=self, survey_id=s_id,
+                               page_size=self.page_size,
+                               concurrency=self.connection.concurrency,
+                               date=date)
+
+
+class AsyncInterviews(Interviews):
+    """
+    interviews fetched with up to concurrency page requests in flight.
+    pages are requested ahead of the one being read and handed back in
+    order, so interviews from the first page are parsed while the later
+    pages are still on the wire. supports both async for and plain for.
+    """
+    def __init__(self, survey: Survey, survey_id, page_size=100,
+                 concurrency=8, date=None):
+        super().__init__(survey=survey, survey_id=survey_id,
+                         page_size=page_size, date=date)
+        self.concurrency = concurrency
+
+    def __aiter__(self):
+        return self._iter_pages()
+
+    def __iter__(self):
+        loop = asyncio.new_event_loop()
+        pages = self._iter_pages()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.close()
+
+    async def _iter_pages(self):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        next_start = 1
+
+        def request_page():
+            nonlocal next_start
+            pending.append(loop.run_in_executor(
+                executor, partial(self.survey.get_page, self.survey_id,
+                                  next_start, self.page_size,
+                                  date=self.date)))
+            next_start += self.page_size
+
+        try:
+            for _ in range(self.concurrency):
+                request_page()
+            while pending:
+                page = await pending.popleft()
+                if len(page) < self.page_size:
+                    # the server ran out of interviews, anything still
+                    # in flight is past the end
+                    for future in pending:
+                        future.cancel()
+                    pending.clear()
+                else:
+                    request_page()
+                for interview in page:
+                    yield ts.load_interview(interview)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InterviewStore:
+    """
+    local store of a survey's interviews keyed by ident, together with
+    the high water mark: the latest interview date merged so far.
+    the file is newline delimited json, one interview per line. a save
+    appends only the interviews merged since the last one followed by a
+    line holding the high water mark, so a sync writes what it fetched
+    rather than the whole store. opening a store reads the high water
+    mark from the end of the file, the interviews are only read when
+    they are first used. the last line of an ident is the current
+    interview, compact() rewrites the file without the older ones.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.high_water_mark = None
+        # interviews merged since the last save
+        self._pending = {}
+        # every interview by ident, read from the file on first use
+        self._interviews = None
+        if os.path.exists(self.file):
+            self.high_water_mark = self._read_high_water_mark()
+
+    def __len__(self):
+        return len(self._stored())
+
+    @property
+    def interviews(self):
+        for interview in self._stored().values():
+            yield ts.load_interview(interview)
+
+    def _stored(self) -> dict:
+        if self._interviews is None:
+            self._interviews = {}
+            if os.path.exists(self.file):
+                self.load()
+            self._interviews.update(self._pending)
+        return self._interviews
+
+    def _read_high_water_mark(self):
+        # the last high water mark line, read backwards from the end
+        with open(self.file, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            tail = b''
+            while end > 0:
+                start = max(end - STORE_BLOCK_SIZE, 0)
+                f.seek(start)
+                tail = f.read(end - start) + tail
+                end = start
+                lines = tail.split(b'\n')
+                # the first piece may be the end of a line in the block
+                # before, the last one is empty or a line cut off by a
+                # failed save
+                for line in reversed(lines[1:-1] if start else lines[:-1]):
+                    stored = json.loads(line)
+                    if 'highWaterMark' in stored:
+                        return stored['highWaterMark']
+                tail = lines[0] + b'\n' if len(lines) > 1 else lines[0]
+        return None
+
+    def load(self):
+        """
+        reads every interview and the high water mark from the file
+        """
+        interviews = {}
+        with open(self.file, encoding='utf8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # cut off by a failed save
+                    break
+                stored = json.loads(line)
+                if 'highWaterMark' in stored:
+                    self.high_water_mark = stored['highWaterMark']
+                else:
+                    interviews[str(stored['ident'])] = stored
+        self._interviews = interviews
+
+    def save(self):
+        """
+        appends the interviews merged since the last save
+        """
+        if not self._pending:
+            return
+        self._truncate()
+        with open(self.file, 'a', encoding='utf8') as f:
+            for interview in self._pending.values():
+                f.write(json.dumps(interview, ensure_ascii=False) + '\n')
+            # the high water mark goes last, interviews after the last
+            # one are from a save that failed and are fetched again
+            f.write(json.dumps({'highWaterMark': self.high_water_mark},
+                               ensure_ascii=False) + '\n')
+        self._pending = {}
+
+    def _truncate(self):
+        # drops a line cut off by a failed save, so that appended lines
+        # start on a line of their own
+        if not os.path.exists(self.file):
+            return
+        with open(self.file, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            size = end
+            while end > 0:
+                start = max(end - STORE_BLOCK_SIZE, 0)
+                f.seek(start)
+                last = f.read(end - start).rfind(b'\n')
+                if last != -1:
+                    end = start + last + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+
+    def compact(self):
+        """
+        rewrites the file with only the current line of every ident
+        """
+        interviews = self._stored()
+        self._pending = {}
+        # write to a temporary file unique to this writer first, so a
+        # failed compaction never leaves a half written store behind
+        handle, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(self.file) or os.curdir, suffix='.tmp')
+        try:
+            with open(handle, 'w', encoding='utf8') as f:
+                for interview in interviews.values():
+                    f.write(json.dumps(interview, ensure_ascii=False) + '\n')
+                f.write(json.dumps({'highWaterMark': self.high_water_mark},
+                                   ensure_ascii=False) + '\n')
+            os.replace(temp_file, self.file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
 
-        return interviews
+    def merge(self, interviews) -> int:
+        """
+        adds new interviews and replaces changed ones with the same ident
+        :return: number of interviews merged
+        """
+        count = 0
+        for interview in interviews:
+            stored = interview.to_tsapi()
+            self._pending[str(interview.ident)] = stored
+            if self._interviews is not None:
+                self._interviews[str(interview.ident)] = stored
+            if interview.date and (self.high_water_mark is None or
+                                   interview.date > self.high_water_mark):
+                self.high_water_mark = interview.date
+            count += 1
+        return count
@@ -0,0 +1,469 @@
+import gzip
+import json
+from json.encoder import INFINITY, encode_basestring, \
+    encode_basestring_ascii
+
+import numpy as np
+
+import tsapiness.tsapi as ts
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class TsapiEncoder:
+    """
+    single pass json serializer for the tsapi object model. it writes the
+    json text of each object straight to the output instead of building
+    the nested dicts of to_tsapi() first, the result is byte for byte
+    json.dumps(obj.to_tsapi(), ensure_ascii=ensure_ascii).
+    classes without a writer here, or subclasses that override to_tsapi,
+    go through to_tsapi() and the json module.
+    with allow_nan=False nan and infinite floats are written as null,
+    the way orjson writes them, rather than the NaN / Infinity of the
+    json module that strict json parsers reject.
+    """
+    def __init__(self, ensure_ascii=True, default=None, allow_nan=True):
+        self._string = encode_basestring_ascii if ensure_ascii \
+            else encode_basestring
+        self._allow_nan = allow_nan
+        self._json = json.JSONEncoder(ensure_ascii=ensure_ascii,
+                                      default=default)
+        self._writers = {
+            ts.SurveyMetadata: self._survey_metadata,
+            ts.Section: self._section,
+            ts.Variable: self._variable,
+            ts.OtherSpecifyVariable: self._other_specify_variable,
+            ts.LoopedVariable: self._looped_variable,
+            ts.VariableValues: self._variable_values,
+            ts.Value: self._value_object,
+            ts.ValueRange: self._value_range,
+            ts.ValueRef: self._value_ref,
+            ts.Label: self._label,
+            ts.AltLabel: self._alt_label,
+            ts.Interview: self._interview,
+            ts.DataItem: self._data_item,
+            ts.LoopedDataItem: self._looped_data_item,
+        }
+        self._writer_cache = {}
+
+    def encode(self, obj) -> str:
+        parts = []
+        self.write(obj, parts.append)
+        return ''.join(parts)
+
+    def dump(self, obj, fp):
+        self.write(obj, fp.write)
+
+    def write(self, obj, w):
+        writer = self._get_writer(type(obj))
+        if writer is not None:
+            writer(obj, w)
+        elif hasattr(obj, 'to_tsapi'):
+            self._value(obj.to_tsapi(), w)
+        else:
+            self._value(obj, w)
+
+    def _get_writer(self, cls):
+        try:
+            return self._writer_cache[cls]
+        except KeyError:
+            pass
+        writer = None
+        for base in cls.__mro__:
+            if base in self._writers:
+                # only when the output of to_tsapi is the one written here
+                if getattr(cls, 'to_tsapi', None) is base.to_tsapi:
+                    writer = self._writers[base]
+                break
+        self._writer_cache[cls] = writer
+        return writer
+
+    def _value(self, v, w):
+        # scalars the way the json module writes them
+        if isinstance(v, str):
+            w(self._string(v))
+        elif v is None:
+            w('null')
+        elif v is True:
+            w('true')
+        elif v is False:
+            w('false')
+        elif isinstance(v, int):
+            w(int.__repr__(v))
+        elif isinstance(v, float):
+            if v != v:
+                w('NaN' if self._allow_nan else 'null')
+            elif v == INFINITY:
+                w('Infinity' if self._allow_nan else 'null')
+            elif v == -INFINITY:
+                w('-Infinity' if self._allow_nan else 'null')
+            else:
+                w(float.__repr__(v))
+        elif self._allow_nan:
+            w(self._json.encode(v))
+        else:
+            w(self._json.encode(_finite(v)))
+
+    def _values(self, values, w):
+        w('[')
+        first = True
+        for v in values:
+            if not first:
+                w(', ')
+            first = False
+            self._value(v, w)
+        w(']')
+
+    def _list(self, items, w):
+        w('[')
+        first = True
+        for item in items:
+            if not first:
+                w(', ')
+            first = False
+            self.write(item, w)
+        w(']')
+
+    @staticmethod
+    def _key(w, sep, key):
+        w(sep)
+        w(key)
+        return ', '
+
+    def _survey_metadata(self, s, w):
+        w('{"hierarchies": ')
+        self._list(s.hierarchies, w)
+        w(', "name": ')
+        self._value(s.name, w)
+        w(', "title": ')
+        self._value(s.title, w)
+        w(', "interviewCount": ')
+        self._value(s.interview_count, w)
+        w(', "languages": ')
+        self._list(s.languages, w)
+        w(', "notAsked": ')
+        self._value(s.not_asked, w)
+        w(', "noAnswer": ')
+        self._value(s.no_answer, w)
+        w(', "variables": ')
+        self._list(s.variables, w)
+        w(', "sections": ')
+        self._list(s.sections, w)
+        w('}')
+
+    def _section(self, s, w):
+        w('{"label": ')
+        self.write(s.label, w)
+        w(', "variables": ')
+        self._list(s.variables, w)
+        w('}')
+
+    def _variable_head(self, v, w):
+        # the members every variable class writes first, each one is left
+        # out when None as add() does in to_tsapi
+        sep = ''
+        if v.ordinal is not None:
+            sep = self._key(w, sep, '"ordinal": ')
+            self._value(v.ordinal, w)
+        if v.label is not None:
+            sep = self._key(w, sep, '"label": ')
+            self.write(v.label, w)
+        if v.name is not None:
+            sep = self._key(w, sep, '"name": ')
+            self._value(v.name, w)
+        if v.ident is not None:
+            sep = self._key(w, sep, '"ident": ')
+            self._value(v.ident, w)
+        if v.type is not None:
+            sep = self._key(w, sep, '"type": ')
+            self._value(v.type, w)
+        if v.variable_values is not None:
+            sep = self._key(w, sep, '"values": ')
+            self.write(v.variable_values, w)
+        if v.use is not None:
+            sep = self._key(w, sep, '"use": ')
+            self._value(v.use, w)
+        if v.maxResponses is not None:
+            sep = self._key(w, sep, '"maxResponses": ')
+            self._value(v.maxResponses, w)
+        return sep
+
+    def _variable(self, v, w):
+        w('{')
+        sep = self._variable_head(v, w)
+        # Variable.to_tsapi wraps these lists in a tuple (trailing comma),
+        # which json writes as a list of one list
+        if len(v.looped_variables) > 0:
+            sep = self._key(w, sep, '"loopedVariables": [')
+            self._list(v.looped_variables, w)
+            w(']')
+        if len(v.otherSpecifyVariables) > 0:
+            self._key(w, sep, '"otherSpecifyVariables": [')
+            self._list(v.otherSpecifyVariables, w)
+            w(']')
+        w('}')
+
+    def _nested_variables(self, v, w, sep):
+        sep = self._key(w, sep, '"loopedVariables": ')
+        self._list(v.looped_variables, w)
+        sep = self._key(w, sep, '"otherSpecifyVariables": ')
+        self._list(v.otherSpecifyVariables, w)
+        return sep
+
+    def _other_specify_variable(self, v, w):
+        w('{')
+        sep = self._variable_head(v, w)
+        sep = self._nested_variables(v, w, sep)
+        if v.parentValueIdent is not None:
+            self._key(w, sep, '"parentValueIdent": ')
+            self._value(v.parentValueIdent, w)
+        w('}')
+
+    def _looped_variable(self, v, w):
+        w('{')
+        sep = self._variable_head(v, w)
+        sep = self._nested_variables(v, w, sep)
+        if v.loop_ref is not None:
+            self._key(w, sep, '"loopRef": ')
+            self.write(v.loop_ref, w)
+        w('}')
+
+    def _variable_values(self, vv, w):
+        w('{')
+        sep = ''
+        if vv.values is not None:
+            sep = self._key(w, sep, '"values": ')
+            self._list(vv.values, w)
+        if vv.range is not None:
+            self._key(w, sep, '"range": ')
+            self.write(vv.range, w)
+        w('}')
+
+    def _value_object(self, v, w):
+        w('{')
+        sep = ''
+        if v.ident is not None:
+            sep = self._key(w, sep, '"ident": ')
+            self._value(v.ident, w)
+        if v.code is not None:
+            sep = self._key(w, sep, '"code": ')
+            self._value(v.code, w)
+        if v.label is not None:
+            sep = self._key(w, sep, '"label": ')
+            self.write(v.label, w)
+        if v.score is not None:
+            sep = self._key(w, sep, '"score": ')
+            self._value(v.score, w)
+        if v.ref is not None:
+            self._key(w, sep, '"ref": ')
+            self._value(v.ref, w)
+        w('}')
+
+    def _value_range(self, r, w):
+        w('{"from": ')
+        self._value(r.range_from, w)
+        w(', "to": ')
+        self._value(r.range_to, w)
+        w('}')
+
+    def _value_ref(self, r, w):
+        w('{"variable_ident": ')
+        self._value(r.variable_ident, w)
+        w(', "value_ident": ')
+        self._value(r.value_ident, w)
+        w('}')
+
+    def _label(self, label, w):
+        w('{')
+        sep = ''
+        if label.text is not None:
+            sep = self._key(w, sep, '"text": ')
+            self._value(label.text, w)
+        if len(label.alt_labels) > 0:
+            self._key(w, sep, '"altLabels": ')
+            self._list(label.alt_labels, w)
+        w('}')
+
+    def _alt_label(self, al, w):
+        w('{"mode": ')
+        self._value(al.mode, w)
+        w(', "text": ')
+        self._value(al.text, w)
+        w(', "langIdent": ')
+        self._value(al.langIdent, w)
+        w('}')
+
+    def _interview(self, iv, w):
+        w('{"ident": ')
+        self._value(iv.ident, w)
+        w(', "date": ')
+        self._value(iv.date, w)
+        w(', "complete": ')
+        self._value(iv.complete, w)
+        w(', "dataItems": ')
+        self._list(iv.data_items, w)
+        if iv.hierarchical_interviews:
+            w(', "hierarchicalInterviews": ')
+            self._list(iv.hierarchical_interviews, w)
+        w('}')
+
+    def _data_item(self, di, w):
+        w('{"ident": ')
+        self._value(di.ident, w)
+        w(', "values": ')
+        self._values(di.values, w)
+        if di.looped_data_items:
+            w(', "loopedDataItems": ')
+            self._list(di.looped_data_items, w)
+        w('}')
+
+    def _looped_data_item(self, ldi, w):
+        w('{"parent": ')
+        self._value(ldi.parent, w)
+        w(', "ident": ')
+        self._value(ldi.ident, w)
+        w(', "values": ')
+        self._values(ldi.values, w)
+        if ldi.looped_data_items:
+            w(', "loopedDataItems": ')
+            self._list(ldi.looped_data_items, w)
+        w('}')
+
+
+_encoders = {}
+
+
+def _get_encoder(ensure_ascii, default, allow_nan=True) -> TsapiEncoder:
+    key = (ensure_ascii, default, allow_nan)
+    if key not in _encoders:
+        _encoders[key] = TsapiEncoder(ensure_ascii=ensure_ascii,
+                                      default=default,
+                                      allow_nan=allow_nan)
+    return _encoders[key]
+
+
+def dumps(obj, ensure_ascii=True, default=None) -> str:
+    """
+    json text of a tsapi object, identical to
+    json.dumps(obj.to_tsapi(), ensure_ascii=ensure_ascii)
+    """
+    return _get_encoder(ensure_ascii, default).encode(obj)
+
+
+def dump(obj, fp, ensure_ascii=True, default=None):
+    """
+    writes the json text of a tsapi object to a text file
+    """
+    _get_encoder(ensure_ascii, default).dump(obj, fp)
+
+
+def _default(obj):
+    # numpy scalars and arrays become the json numbers and lists they
+    # hold, anything else its str(). used by both encoders below so the
+    # output does not depend on whether orjson is installed
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    return str(obj)
+
+
+def _finite(v):
+    # v with nan and infinite floats, numpy ones included, as None
+    if isinstance(v, (np.generic, np.ndarray)):
+        v = v.tolist()
+    if isinstance(v, float):
+        return v if v - v == 0 else None
+    if isinstance(v, dict):
+        return {key: _finite(item) for key, item in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_finite(item) for item in v]
+    return v
+
+
+def _encode_orjson(obj) -> bytes:
+    # numpy scalars are written as numbers, datetimes go to _default
+    # like they do with the json module
+    return orjson.dumps(obj.to_tsapi(), default=_default,
+                        option=orjson.OPT_SERIALIZE_NUMPY |
+                        orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def _encode_json(obj) -> bytes:
+    # nan written as null like orjson does
+    return _get_encoder(False, _default,
+                        allow_nan=False).encode(obj).encode('utf8')
+
+
+# orjson is used when it is installed, the output is the same without it
+encode = _encode_orjson if orjson is not None else _encode_json
+
+
+class _Output:
+    """
+    opens a path or wraps a binary file like object (e.g. the result of
+    socket.makefile('wb')), optionally gzip compressed
+    """
+    def __init__(self, file, compress=None):
+        self.file = file
+        if compress is None:
+            compress = isinstance(file, str) and file.endswith('.gz')
+        self.compress = compress
+        self._owned = isinstance(file, str)
+        self._raw = None
+        self._f = None
+
+    def __enter__(self):
+        self._raw = open(self.file, 'wb') if self._owned else self.file
+        self._f = gzip.GzipFile(fileobj=self._raw, mode='wb') \
+            if self.compress else self._raw
+        return self._f
+
+    def __exit__(self, *exc):
+        if self.compress:
+            self._f.close()
+        if self._owned:
+            self._raw.close()
+        else:
+            self._raw.flush()
+
+
+def write_metadata(metadata, file, compress=None):
+    """
+    writes SurveyMetadata as a json document
+    :param file: path or binary file like object
+    :param compress: gzip the output, by default when the path ends .gz
+    """
+    with _Output(file, compress=compress) as f:
+        f.write(encode(metadata))
+
+
+def write_interviews(interviews, file, ndjson=False, compress=None) -> int:
+    """
+    streams interviews to a file one at a time, only the interview being
+    written is converted with to_tsapi so memory does not grow with the
+    number of interviews
+    :param interviews: any iterable of Interview, e.g. survey.interviews
+    :param file: path or binary file like object
+    :param ndjson: write one interview per line instead of a json array
+    :param compress: gzip the output, by default when the path ends .gz
+    :return: number of interviews written
+    """
+    count = 0
+    with _Output(file, compress=compress) as f:
+        if ndjson:
+            for interview in interviews:
+                f.write(encode(interview))
+                f.write(b'\n')
+                count += 1
+            return count
+
+        f.write(b'[')
+        for interview in interviews:
+            if count:
+                f.write(b',\n')
+            f.write(encode(interview))
+            count += 1
+        f.write(b']')
+    return count
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import tsapiness.tsapi as ts
+import tsapiness.export as export
+
+# a snapshot is a directory holding
+#   metadata.json   the SurveyMetadata as tsapi json
+#   manifest.json   the row count and the .npy file of every column
+#   idents.npy, dates.npy, complete.npy and columns/<n>.npy
+#   looped/<n>.npy and hierarchical.npy when there are any
+# numeric, bool and string columns are plain .npy files that are memory
+# mapped on load. columns of python objects (lists of values, mixed
+# types, looped data items) are pickled by numpy and read into memory,
+# only open snapshots you wrote yourself.
+FORMAT_VERSION = 1
+METADATA_FILE = 'metadata.json'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _compact(array: np.ndarray) -> np.ndarray:
+    # object arrays of nothing but strings become fixed width unicode so
+    # they can be memory mapped
+    if array.dtype == object and len(array) and \
+            all(isinstance(v, str) for v in array):
+        return array.astype(str)
+    return array
+
+
+def _save_array(directory, file, array) -> dict:
+    array = _compact(np.asarray(array))
+    np.save(os.path.join(directory, file), array, allow_pickle=True)
+    return {'file': file, 'pickled': array.dtype.hasobject}
+
+
+def _load_array(directory, entry, memory_map) -> np.ndarray:
+    mmap_mode = 'r' if memory_map and not entry['pickled'] else None
+    return np.load(os.path.join(directory, entry['file']),
+                   mmap_mode=mmap_mode, allow_pickle=entry['pickled'])
+
+
+def save(directory, metadata: ts.SurveyMetadata, interviews) -> int:
+    """
+    writes the metadata and the interviews column-wise to a snapshot
+    directory, replacing any snapshot already there
+    :param interviews: a ColumnarInterviews or any iterable of Interview
+    :return: number of interviews written
+    :raises FileExistsError: when directory exists and is neither empty
+    nor a snapshot
+    """
+    directory = os.path.normpath(os.fspath(directory))
+    if os.path.exists(directory) and not is_snapshot(directory) and \
+            not (os.path.isdir(directory) and not os.listdir(directory)):
+        raise FileExistsError(f'{directory} exists and is not a snapshot')
+    if not isinstance(interviews, ts.ColumnarInterviews):
+        interviews = ts.ColumnarInterviews.from_interviews(interviews)
+
+    # written to a new temporary directory next to it first so a failed
+    # save never leaves a half written snapshot behind
+    temp_directory = tempfile.mkdtemp(
+        prefix=f'{os.path.basename(directory)}.', suffix='.tmp',
+        dir=os.path.dirname(directory) or os.curdir)
+    try:
+        count = _write(temp_directory, metadata, interviews)
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(temp_directory, directory)
+    return count
+
+
+def is_snapshot(directory) -> bool:
+    return os.path.isfile(os.path.join(directory, MANIFEST_FILE))
+
+
+def _write(temp_directory, metadata, interviews) -> int:
+    os.makedirs(os.path.join(temp_directory, 'columns'))
+    os.makedirs(os.path.join(temp_directory, 'looped'))
+
+    # the json module rather than export.encode, orjson would write a nan
+    # value range as null
+    with open(os.path.join(temp_directory, METADATA_FILE), 'w',
+              encoding='utf8') as f:
+        export.dump(metadata, f, ensure_ascii=False,
+                    default=export._default)
+    manifest = {
+        'version': FORMAT_VERSION,
+        'rows': len(interviews),
+        'idents': _save_array(temp_directory, 'idents.npy',
+                              interviews.idents),
+        'dates': _save_array(temp_directory, 'dates.npy', interviews.dates),
+        'complete': _save_array(temp_directory, 'complete.npy',
+                                interviews.complete),
+        'columns': [],
+        'looped': [],
+        'hierarchical': None,
+    }
+    for n, (ident, column) in enumerate(interviews.columns.items()):
+        entry = _save_array(temp_directory, f'columns/{n}.npy', column)
+        entry['ident'] = ident
+        manifest['columns'].append(entry)
+    for n, (ident, column) in enumerate(interviews.looped.items()):
+        entry = _save_array(temp_directory, f'looped/{n}.npy', column)
+        entry['ident'] = ident
+        manifest['looped'].append(entry)
+    if interviews.hierarchical is not None:
+        manifest['hierarchical'] = _save_array(
+            temp_directory, 'hierarchical.npy', interviews.hierarchical)
+    # the manifest goes last, a directory without one is not a snapshot
+    with open(os.path.join(temp_directory, MANIFEST_FILE), 'w',
+              encoding='utf8') as f:
+        json.dump(manifest, f, ensure_ascii=False, default=str)
+    return len(interviews)
+
+
+def load(directory, memory_map=True):
+    """
+    opens a snapshot directory written by save
+    :param memory_map: map the column files rather than read them, the
+    data is only paged in as it is used
+    :return: tuple of SurveyMetadata and ColumnarInterviews
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), encoding='utf8') as f:
+        manifest = json.load(f)
+    if manifest['version'] != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version "
+                         f"{manifest['version']} in {directory}")
+    with open(os.path.join(directory, METADATA_FILE), encoding='utf8') as f:
+        metadata = ts.load_metadata(json.load(f))
+
+    hierarchical = manifest['hierarchical']
+    interviews = ts.ColumnarInterviews(
+        idents=_load_array(directory, manifest['idents'], memory_map),
+        dates=_load_array(directory, manifest['dates'], memory_map),
+        complete=_load_array(directory, manifest['complete'], memory_map),
+        columns={entry['ident']: _load_array(directory, entry, memory_map)
+                 for entry in manifest['columns']},
+        looped={entry['ident']: _load_array(directory, entry, memory_map)
+                for entry in manifest['looped']},
+        hierarchical=None if hierarchical is None
+        else _load_array(directory, hierarchical, memory_map))
+    return metadata, interviews
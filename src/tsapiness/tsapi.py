@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+
+
 def add(d, label, obj, apply_to_tsapi=False):
     if apply_to_tsapi:
         if obj is not None:
@@ -18,35 +22,62 @@ def parse(list_to_parse: list, obj: object) -> list:
     return list_to_return
 
 
-def flatten_variable(variable, variable_list):
-    if len(variable.looped_variables) > 0 and len(variable.values) > 0:
-        for value in variable.values:
-            _a = variable.to_dict()
+def _index_key(items) -> tuple:
+    # an index is rebuilt when the list it was built from is replaced or
+    # changes length. the list itself is kept rather than its id, which a
+    # new list can reuse once the old one is freed. items replaced in
+    # place need invalidate_index() on the object holding the index
+    return items, len(items)
+
+
+def _is_current(key, items) -> bool:
+    return key is not None and key[0] is items and key[1] == len(items)
+
+
+def _walk_variables(variables):
+    for variable in variables:
+        yield variable
+        yield from _walk_variables(variable.looped_variables)
+        yield from _walk_variables(variable.otherSpecifyVariables)
+
+
+def _flatten_rows(variable, memo: dict) -> list:
+    # rows of flatten_variable for one variable. looped variables repeat
+    # once per parent value, the memo keeps each one from being
+    # flattened again
+    key = id(variable)
+    if key in memo:
+        return memo[key]
+    rows = []
+    values = variable.values
+    looped_variables = variable.looped_variables
+    if len(looped_variables) > 0 and len(values) > 0:
+        base = variable.to_dict()
+        for value in values:
+            _a = dict(base)
             _a.update(value.to_dict())
-            variable_list.append(_a)
+            rows.append(_a)
         for loop_variable in variable.looped_variable_values:
-            flatten_variable(variable=loop_variable,
-                             variable_list=variable_list)
-    elif len(variable.looped_variables) == 0 and len(variable.values) > 0:
-        _a = variable.to_dict()
-        for value in variable.values:
-            _a = variable.to_dict()
+            rows.extend(_flatten_rows(loop_variable, memo))
+    elif len(looped_variables) == 0 and len(values) > 0:
+        base = variable.to_dict()
+        for value in values:
+            _a = dict(base)
             _a.update(value.to_dict())
-            variable_list.append(_a)
-    elif len(variable.looped_variables) > 0 and len(variable.values) == 0:
+            rows.append(_a)
+    elif len(looped_variables) > 0 and len(values) == 0:
         # check if this is valid
         pass
-
-    elif len(variable.looped_variables) == 0 and len(variable.values) == 0:
-        _a = variable.to_dict()
-        variable_list.append(_a)
     else:
-        _a = variable.to_dict()
-        variable_list.append(_a)
-    if len(variable.otherSpecifyVariables) > 0:
-        for osv in variable.otherSpecifyVariables:
-            flatten_variable(variable=osv, variable_list=variable_list)
+        rows.append(variable.to_dict())
+    for osv in variable.otherSpecifyVariables:
+        rows.extend(_flatten_rows(osv, memo))
+    memo[key] = rows
+    return rows
+
 
+def flatten_variable(variable, variable_list):
+    variable_list.extend(dict(row) for row in _flatten_rows(variable, {}))
     return variable_list
 
 
@@ -63,10 +94,78 @@ class SurveyMetadata:
         self.variables = parse(variables, Variable)
         self.sections = parse(sections, Section)
         self.languages = parse(languages, Language)
+        self._variable_index = None
+        self._variable_index_key = None
+        self._flat_table = None
+        self._flat_frame = None
+        self._flat_table_key = None
 
     def __str__(self):
         return f'Name: {self.name}, Title {self.title}'
 
+    def flat_table(self, as_dataframe=False):
+        """
+        the variables flattened to one row per variable value as
+        flatten_variable does, computed once and cached until the
+        variables list is replaced or changes length. edits made in
+        place (a variable renamed, a value added to a variable, a
+        variable replaced in the list) are not seen, call
+        invalidate_index() after them.
+        the rows are shared with the cache, copy them before changing
+        :param as_dataframe: return the rows as a pandas DataFrame
+        :return: list of row dicts or DataFrame
+        """
+        if not _is_current(self._flat_table_key, self.variables):
+            memo = {}
+            self._flat_table = [dict(row) for variable in self.variables
+                                for row in _flatten_rows(variable, memo)]
+            self._flat_frame = None
+            self._flat_table_key = _index_key(self.variables)
+        if not as_dataframe:
+            return self._flat_table
+        if self._flat_frame is None:
+            self._flat_frame = pd.DataFrame(self._flat_table)
+        return self._flat_frame
+
+    def variable(self, ident) -> 'Variable':
+        """
+        looks a variable up by ident, including looped, other specify and
+        section variables, through an index built on first use
+        :raises KeyError: when there is no variable with that ident
+        """
+        index = self._get_variable_index()
+        if ident not in index:
+            # a variable may have been added further down the tree
+            index = self._get_variable_index(rebuild=True)
+        return index[ident]
+
+    def _get_variable_index(self, rebuild=False) -> dict:
+        key = self._variable_index_key
+        if rebuild or key is None or \
+                not _is_current(key[0], self.variables) or \
+                not _is_current(key[1], self.sections):
+            index = {}
+            for variable in _walk_variables(self.variables):
+                index.setdefault(variable.ident, variable)
+            for section in self.sections:
+                for variable in _walk_variables(section.variables):
+                    index.setdefault(variable.ident, variable)
+            self._variable_index = index
+            self._variable_index_key = (_index_key(self.variables),
+                                        _index_key(self.sections))
+        return self._variable_index
+
+    def invalidate_index(self):
+        """
+        drops the cached variable index and flat table, for changes made
+        in place that keep the length of the lists
+        """
+        self._variable_index = None
+        self._variable_index_key = None
+        self._flat_table = None
+        self._flat_frame = None
+        self._flat_table_key = None
+
     def __repr__(self):
         return f'Survey({self.name})'
 
@@ -119,32 +218,47 @@ class Section:
 
 
 class Label:
+    __slots__ = ('text', 'alt_labels', '_modes', '_modes_key')
+
     def __init__(self, text, altLabels=None):
 
         self.text = text
         self.alt_labels = parse(altLabels, AltLabel)
+        self._modes = None
+        self._modes_key = None
 
     def __str__(self):
         return self.text
 
+    def alt_label_text(self, mode) -> str:
+        """
+        text of the first alt label for mode, from an index of the alt
+        labels built on first use
+        """
+        if not self.alt_labels:
+            return ""
+        if not _is_current(self._modes_key, self.alt_labels):
+            modes = {}
+            for alts in self.alt_labels:
+                modes.setdefault(alts.mode, alts.text)
+            self._modes = modes
+            self._modes_key = _index_key(self.alt_labels)
+        return self._modes.get(mode, "")
+
+    def invalidate_index(self):
+        """
+        drops the cached alt label index, for alt labels changed in place
+        """
+        self._modes = None
+        self._modes_key = None
+
     @property
     def label_analysis(self) -> str:
-        alt_text = ""
-        if self.alt_labels:
-            for alts in self.alt_labels:
-                if alts.mode == 'analysis':
-                    alt_text = alts.text
-                    return alt_text
-        return alt_text
+        return self.alt_label_text('analysis')
 
     @property
     def label_interview(self) -> str:
-        alt_text = ""
-        if self.alt_labels:
-            for alts in self.alt_labels:
-                if alts.mode == 'interview':
-                    return alts.text
-        return alt_text
+        return self.alt_label_text('interview')
 
     def to_tsapi(self):
         _dict = {}
@@ -181,6 +295,32 @@ class Variable:
         self.variable_values = VariableValues(**values)
 
         self.looped_variables = parse(loopedVariables, LoopedVariable)
+        self._value_index = None
+        self._value_index_key = None
+
+    def value(self, ident_or_code) -> 'Value':
+        """
+        looks a value up by its ident or code through an index built on
+        first use, idents take precedence over codes
+        :raises KeyError: when there is no such value
+        """
+        values = self.values or []
+        if not _is_current(self._value_index_key, values):
+            index = {}
+            for value in values:
+                index.setdefault(value.code, value)
+            for value in values:
+                index[value.ident] = value
+            self._value_index = index
+            self._value_index_key = _index_key(values)
+        return self._value_index[ident_or_code]
+
+    def invalidate_index(self):
+        """
+        drops the cached value index, for values changed in place
+        """
+        self._value_index = None
+        self._value_index_key = None
 
     def to_tsapi(self):
 
@@ -298,6 +438,8 @@ class Language:
 
 
 class AltLabel:
+    __slots__ = ('mode', 'text', 'langIdent')
+
     def __init__(self, mode='interview', text="", langIdent=""):
         self.mode = mode
         self.text = text
@@ -358,6 +500,8 @@ class ValueRef:
 
 
 class Value:
+    __slots__ = ('ident', 'code', 'label', 'score', 'ref')
+
     def __init__(self, ident="", code="", label=None, score=0, ref=None):
         if ref is None:
             ref = {}
@@ -476,7 +620,8 @@ class LoopedVariable(Variable):
                  maxResponses=0,
                  loopedVariables=None,
                  otherSpecifyVariables=None,
-                 loop_ref=None):
+                 loop_ref=None,
+                 loopRef=None):
         super().__init__(ordinal=ordinal,
                          label=label,
                          name=name,
@@ -489,6 +634,8 @@ class LoopedVariable(Variable):
                          otherSpecifyVariables=otherSpecifyVariables)
 
         self.loop_ref = loop_ref
+        if loopRef is not None:
+            self.loop_ref = _load_value_ref(loopRef)
 
     def to_tsapi(self):
         _dict = {}
@@ -615,8 +762,21 @@ class InterviewsQuery:
         self.interview_idents = interviewIdents
         self.date = date
 
+    def to_tsapi(self):
+        _dict = {}
+        _dict = add(_dict, 'surveyId', self.survey_id)
+        _dict = add(_dict, 'start', self.start)
+        _dict = add(_dict, 'maxLength', self.max_length)
+        _dict = add(_dict, 'completeOnly', self.complete_only)
+        _dict = add(_dict, 'variables', self.variables)
+        _dict = add(_dict, 'interviewIdents', self.interview_idents)
+        _dict = add(_dict, 'date', self.date)
+        return _dict
+
 
 class LoopedDataItem:
+    __slots__ = ('parent', 'ident', 'values', 'looped_data_items')
+
     def __init__(self,
                  parent="",
                  ident="",
@@ -644,6 +804,8 @@ class LoopedDataItem:
 
 
 class DataItem:
+    __slots__ = ('ident', 'values', 'looped_data_items')
+
     def __init__(self, ident="", values=None, loopedDataItems=None):
         self.ident = ident
         self.values = [v for v in values]
@@ -697,6 +859,9 @@ class HierarchicalInterview:
 
 
 class Interview:
+    __slots__ = ('ident', 'date', 'complete', 'data_items',
+                 'hierarchical_interviews', '_index', '_index_key')
+
     def __init__(self, ident="", date="", complete=True, dataItems=None,
                  hierarchicalInterviews=None):
         self.ident = ident
@@ -705,6 +870,43 @@ class Interview:
         self.data_items = parse(dataItems, DataItem)
         self.hierarchical_interviews = parse(hierarchicalInterviews,
                                              HierarchicalInterview)
+        self._index = None
+        self._index_key = None
+
+    def __getitem__(self, ident) -> DataItem:
+        """
+        data item by variable ident, through an index built on first use
+        :raises KeyError: when the interview has no data for the ident
+        """
+        if not _is_current(self._index_key, self.data_items):
+            index = {}
+            for di in self.data_items:
+                index.setdefault(di.ident, di)
+            self._index = index
+            self._index_key = _index_key(self.data_items)
+        return self._index[ident]
+
+    def __iter__(self):
+        """
+        the data items, with a string keyed __getitem__ python would
+        otherwise iterate by calling it with 0, 1, 2...
+        """
+        return iter(self.data_items)
+
+    def invalidate_index(self):
+        """
+        drops the cached data item index, for data items replaced or
+        renamed in place
+        """
+        self._index = None
+        self._index_key = None
+
+    def __contains__(self, ident) -> bool:
+        try:
+            self[ident]
+        except KeyError:
+            return False
+        return True
 
     def to_tsapi(self):
         _dict = {'ident': self.ident,
@@ -716,3 +918,310 @@ class Interview:
                                                self.hierarchical_interviews]
 
         return _dict
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _to_python(value):
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+
+def _column_array(values: list) -> np.ndarray:
+    kinds = {type(v) for v in values}
+    if kinds and kinds <= {int, float}:
+        return np.array(values)
+    if kinds and kinds <= {float, type(None)}:
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=np.float64)
+    if kinds == {str}:
+        return np.array(values, dtype=str)
+    column = np.empty(len(values), dtype=object)
+    for row, value in enumerate(values):
+        column[row] = value
+    return column
+
+
+class ColumnarInterviews:
+    """
+    column-wise store of interviews: one array per variable ident and a
+    row index of interview idents, dates and completeness. a variable
+    across all interviews is a single array lookup, Interview and
+    DataItem objects are only built when the store is iterated.
+    a column holds one value per row, a list per row in an object
+    array, or is a 2d array of rows x values. nan and None are missing
+    and produce no data item.
+    looped data items are kept per variable ident in looped, an object
+    array holding the list of LoopedDataItem of each row (or None), and
+    the hierarchical interviews of each row in the hierarchical object
+    array.
+    """
+    def __init__(self, idents, dates=None, complete=None, columns=None,
+                 looped=None, hierarchical=None):
+        self.idents = np.asarray(idents)
+        rows = len(self.idents)
+        if dates is None:
+            dates = np.full(rows, None, dtype=object)
+        if complete is None:
+            complete = np.ones(rows, dtype=bool)
+        self.dates = np.asarray(dates)
+        self.complete = np.asarray(complete, dtype=bool)
+        self.columns = dict(columns or {})
+        self.looped = dict(looped or {})
+        self.hierarchical = hierarchical
+
+    def __len__(self):
+        return len(self.idents)
+
+    def __getitem__(self, ident) -> np.ndarray:
+        return self.columns[ident]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.interview(row)
+
+    def interview(self, row: int) -> Interview:
+        iv = Interview(ident=_to_python(self.idents[row]),
+                       date=_to_python(self.dates[row]),
+                       complete=bool(self.complete[row]))
+        for ident, column in self.columns.items():
+            value = _to_python(column[row])
+            values = value if isinstance(value, list) else [value]
+            values = [v for v in values if not _is_missing(v)]
+            looped = self.looped.get(ident)
+            looped_data_items = None if looped is None else looped[row]
+            if values or looped_data_items:
+                di = DataItem(ident=ident, values=values)
+                di.looped_data_items = looped_data_items
+                iv.data_items.append(di)
+        if self.hierarchical is not None and self.hierarchical[row]:
+            iv.hierarchical_interviews = list(self.hierarchical[row])
+        return iv
+
+    @classmethod
+    def from_interviews(cls, interviews) -> 'ColumnarInterviews':
+        """
+        fills the store from any iterable of Interview in one pass,
+        data items with a single value are stored as that value
+        :raises ValueError: when an interview has two data items for the
+        same variable ident
+        """
+        idents = []
+        dates = []
+        complete = []
+        values = {}
+        looped = {}
+        hierarchical = {}
+        for row, iv in enumerate(interviews):
+            idents.append(iv.ident)
+            dates.append(iv.date)
+            complete.append(iv.complete)
+            for di in iv.data_items:
+                column = values.setdefault(di.ident, [])
+                if len(column) > row:
+                    raise ValueError(f'interview {iv.ident} has more than '
+                                     f'one data item {di.ident}')
+                column.extend([None] * (row - len(column)))
+                column.append(di.values[0] if len(di.values) == 1
+                              else list(di.values))
+                if di.looped_data_items:
+                    looped.setdefault(di.ident, {})[row] = \
+                        di.looped_data_items
+            if iv.hierarchical_interviews:
+                hierarchical[row] = iv.hierarchical_interviews
+        for column in values.values():
+            column.extend([None] * (len(idents) - len(column)))
+
+        def object_array(items: dict):
+            array = np.full(len(idents), None, dtype=object)
+            for row, item in items.items():
+                array[row] = item
+            return array
+
+        dates_array = np.empty(len(dates), dtype=object)
+        dates_array[:] = dates
+        return cls(idents=_column_array(idents),
+                   dates=dates_array,
+                   complete=complete,
+                   columns={ident: _column_array(column)
+                            for ident, column in values.items()},
+                   looped={ident: object_array(rows)
+                           for ident, rows in looped.items()},
+                   hierarchical=object_array(hierarchical)
+                   if hierarchical else None)
+
+
+class LazyInterview(Interview):
+    """
+    interview loaded by load_interviews(lazy=True), its data items are
+    built from the raw json the first time data_items is read
+    """
+    __slots__ = ('_raw_items', '_data_items')
+
+    @property
+    def data_items(self) -> list:
+        if self._data_items is None:
+            raw_items = self._raw_items or []
+            self._data_items = [load_data_item(r) for r in raw_items]
+            self._raw_items = None
+        return self._data_items
+
+    @data_items.setter
+    def data_items(self, data_items):
+        self._data_items = data_items
+        self._raw_items = None
+
+
+# the loaders below build the object model straight from decoded tsapi
+# json: they set attributes directly instead of going through the
+# keyword arguments of each __init__, and take ownership of the values
+# lists of the raw data rather than copying them.
+
+def load_data_item(raw: dict) -> DataItem:
+    di = DataItem.__new__(DataItem)
+    di.ident = raw.get('ident', "")
+    di.values = raw['values']
+    looped = raw.get('loopedDataItems')
+    di.looped_data_items = None if looped is None \
+        else [LoopedDataItem(**lr) for lr in looped]
+    return di
+
+
+def load_interview(raw: dict, lazy=False) -> Interview:
+    if lazy:
+        iv = LazyInterview.__new__(LazyInterview)
+        iv._raw_items = raw.get('dataItems')
+        iv._data_items = None
+    else:
+        iv = Interview.__new__(Interview)
+        items = raw.get('dataItems')
+        iv.data_items = [] if items is None \
+            else [load_data_item(r) for r in items]
+    iv.ident = raw.get('ident', "")
+    iv.date = raw.get('date', "")
+    iv.complete = raw.get('complete', True)
+    iv.hierarchical_interviews = parse(raw.get('hierarchicalInterviews'),
+                                       HierarchicalInterview)
+    iv._index = None
+    iv._index_key = None
+    return iv
+
+
+def load_interviews(raw_interviews, lazy=False) -> list:
+    """
+    builds Interview objects from a list of tsapi interview json objects
+    :param lazy: defer building the data items of each interview until
+    they are first read
+    """
+    return [load_interview(raw, lazy=lazy) for raw in raw_interviews]
+
+
+def _load_label(raw: dict) -> Label:
+    label = Label.__new__(Label)
+    label.text = raw.get('text', "")
+    alt_labels = raw.get('altLabels')
+    label.alt_labels = [] if alt_labels is None \
+        else [AltLabel(**al) for al in alt_labels]
+    label._modes = None
+    label._modes_key = None
+    return label
+
+
+def _load_value(raw: dict) -> Value:
+    value = Value.__new__(Value)
+    value.ident = raw.get('ident', "")
+    value.code = raw.get('code', "")
+    value.label = _load_label(raw.get('label') or {})
+    value.score = raw.get('score', 0)
+    value.ref = None
+    return value
+
+
+def _load_variable_values(raw: dict) -> VariableValues:
+    variable_values = VariableValues.__new__(VariableValues)
+    values = raw.get('values')
+    variable_values.values = [] if values is None \
+        else [_load_value(v) for v in values]
+    value_range = raw.get('range')
+    variable_values.range = None if value_range is None \
+        else ValueRange(**value_range)
+    return variable_values
+
+
+def _load_value_ref(raw: dict) -> ValueRef:
+    # ValueRef.to_tsapi writes variable_ident / value_ident, read both
+    # that and the tsapi variableIdent / valueIdent
+    return ValueRef(
+        variableIdent=raw.get('variableIdent', raw.get('variable_ident', "")),
+        valueIdent=raw.get('valueIdent', raw.get('value_ident', "")))
+
+
+def _raw_variables(raw) -> list:
+    # Variable.to_tsapi writes looped and other specify variables as a
+    # list wrapped in a one item list, read both that and the plain list
+    items = raw or []
+    if len(items) == 1 and isinstance(items[0], list):
+        return items[0]
+    return items
+
+
+def _load_variable(raw: dict, cls=Variable) -> Variable:
+    variable = cls.__new__(cls)
+    variable.ident = raw.get('ident', "")
+    variable.ordinal = raw.get('ordinal', 0)
+    variable.type = raw.get('type', "")
+    variable.name = raw.get('name', "")
+    variable.label = _load_label(raw['label'])
+    variable.use = raw.get('use', "")
+    variable.maxResponses = raw.get('maxResponses', 0)
+    variable.otherSpecifyVariables = [
+        _load_variable(o, OtherSpecifyVariable)
+        for o in _raw_variables(raw.get('otherSpecifyVariables'))]
+    variable.variable_values = _load_variable_values(raw.get('values') or {})
+    variable.looped_variables = [
+        _load_variable(lv, LoopedVariable)
+        for lv in _raw_variables(raw.get('loopedVariables'))]
+    variable._value_index = None
+    variable._value_index_key = None
+    if cls is OtherSpecifyVariable:
+        variable.parentValueIdent = raw.get('parentValueIdent', "")
+    elif cls is LoopedVariable:
+        loop_ref = raw.get('loopRef')
+        variable.loop_ref = None if loop_ref is None \
+            else _load_value_ref(loop_ref)
+    return variable
+
+
+def _load_section(raw: dict) -> Section:
+    section = Section.__new__(Section)
+    section.label = _load_label(raw['label'])
+    section.sections = ""
+    section.variables = [_load_variable(v)
+                         for v in raw.get('variables') or []]
+    return section
+
+
+def load_metadata(raw: dict) -> SurveyMetadata:
+    """
+    builds SurveyMetadata from a tsapi metadata json object
+    """
+    survey = SurveyMetadata.__new__(SurveyMetadata)
+    survey.hierarchies = parse(raw.get('hierarchies'), Hierarchy)
+    survey.name = raw.get('name', "")
+    survey.title = raw.get('title', "")
+    survey.interview_count = raw.get('interviewCount', 0)
+    survey.not_asked = raw.get('notAsked', "")
+    survey.no_answer = raw.get('noAnswer', "")
+    survey.variables = [_load_variable(v)
+                        for v in raw.get('variables') or []]
+    survey.sections = [_load_section(s) for s in raw.get('sections') or []]
+    survey.languages = parse(raw.get('languages'), Language)
+    survey._variable_index = None
+    survey._variable_index_key = None
+    survey._flat_table = None
+    survey._flat_frame = None
+    survey._flat_table_key = None
+    return survey
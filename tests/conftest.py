@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import tsapiness.connector_sss as cs
+import tsapiness.connector_tsapi as ct
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+SSS_FILE = os.path.join(DATA, 'survey.sss')
+ASC_FILE = os.path.join(DATA, 'survey.asc')
+INTERVIEW_COUNT = 250
+
+METADATA = {
+    'name': 'STUB',
+    'title': 'Stub survey',
+    'interviewCount': INTERVIEW_COUNT,
+    'variables': [
+        {'ident': 'Q1', 'name': 'Q1', 'type': 'single',
+         'label': {'text': 'Gender',
+                   'altLabels': [{'mode': 'analysis', 'text': 'Sex',
+                                  'langIdent': 'en'}]},
+         'values': {'values': [
+             {'ident': '1', 'code': '1', 'label': {'text': 'Male'}},
+             {'ident': '2', 'code': '2', 'label': {'text': 'Female'}}]}},
+        {'ident': 'Q2', 'name': 'Q2', 'type': 'quantity',
+         'label': {'text': 'Age'},
+         'values': {'range': {'from': 0, 'to': 99}}},
+        {'ident': 'BRAND', 'name': 'BRAND', 'type': 'multiple',
+         'label': {'text': 'Marques préférées'},
+         'values': {'values': [
+             {'ident': 'A', 'code': '1', 'label': {'text': 'Brand A'}},
+             {'ident': 'B', 'code': '2', 'label': {'text': 'Brand B'}},
+             {'ident': 'O', 'code': '9', 'label': {'text': 'Other'}}]},
+         'loopedVariables': [
+             {'ident': 'RATING', 'name': 'RATING', 'type': 'single',
+              'label': {'text': 'Rating'},
+              'loopRef': {'variableIdent': 'BRAND', 'valueIdent': 'A'},
+              'values': {'values': [
+                  {'ident': 'G', 'code': '1', 'label': {'text': 'Good'}},
+                  {'ident': 'P', 'code': '2', 'label': {'text': 'Poor'}}]}}],
+         'otherSpecifyVariables': [
+             {'ident': 'BRAND_O', 'name': 'BRAND_O', 'type': 'character',
+              'label': {'text': 'Other brand'},
+              'parentValueIdent': 'O'}]},
+    ],
+}
+
+
+def _interview(n: int) -> dict:
+    return {'ident': str(n),
+            'date': f'2022-07-{n % 28 + 1:02d}T00:00:00',
+            'complete': True,
+            'dataItems': [
+                {'ident': 'Q1', 'values': [str(n % 2 + 1)]},
+                {'ident': 'Q2', 'values': [str(n % 90)]},
+                {'ident': 'BRAND', 'values': ['1', '2'],
+                 'loopedDataItems': [
+                     {'parent': '1', 'ident': 'RATING', 'values': ['1']},
+                     {'parent': '2', 'ident': 'RATING',
+                      'values': [str(n % 2 + 1)]}]},
+                {'ident': 'BRAND_O', 'values': [f'Café n°{n}']}]}
+
+
+INTERVIEWS = [_interview(n) for n in range(1, INTERVIEW_COUNT + 1)]
+METADATA_ETAG = '"stub-metadata-1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    the parts of a tsapi server the connector uses, every request is
+    logged on the server
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, obj, status=200, headers=None):
+        body = b'' if status == 304 else json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # the metadata carries an ETag, a GET sending it back is
+        # answered 304 and logged with it
+        etag = self.headers.get('If-None-Match')
+        self.server.log.append(('GET', self.path, etag))
+        if self.path == '/Surveys':
+            return self.send([{'id': 'stub', 'name': 'STUB'}])
+        if self.path == '/Surveys/stub/Metadata':
+            if etag == METADATA_ETAG:
+                return self.send(None, 304)
+            return self.send(METADATA, headers={'ETag': METADATA_ETAG})
+        self.send({}, 404)
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        query = json.loads(self.rfile.read(length))
+        self.server.log.append(('POST', self.path, query))
+        rows = INTERVIEWS
+        if query.get('date'):
+            rows = [r for r in rows if r['date'] > query['date']]
+        start = query.get('start', 1)
+        self.send(rows[start - 1:start - 1 + query.get('maxLength', 100)])
+
+
+@pytest.fixture
+def tsapi_server():
+    """
+    a local stub tsapi server, yields it with its url as server.url
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.log = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_tsapi_survey(server, cache=None, **kwargs) -> ct.Survey:
+    connection = ct.Connection(server=server.url, cache=cache)
+    return ct.Survey(survey_id='stub', connection=connection, date=None,
+                     **kwargs)
+
+
+@pytest.fixture
+def tsapi_survey(tsapi_server):
+    """
+    makes Surveys of the stub server, keyword arguments go to Survey
+    apart from cache, which goes to its Connection
+    """
+    return partial(make_tsapi_survey, tsapi_server)
+
+
+def make_sss_survey(asc_file=ASC_FILE, memory_map=False,
+                    **kwargs) -> cs.Survey:
+    connection = cs.Connection(asc_file=asc_file, sss_file=SSS_FILE,
+                               memory_map=memory_map)
+    return cs.Survey(connection=connection, **kwargs)
+
+
+@pytest.fixture
+def sss_survey():
+    """
+    makes Surveys of tests/data/survey.sss, by default over survey.asc
+    """
+    return make_sss_survey
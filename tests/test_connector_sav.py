@@ -0,0 +1,77 @@
+import pandas as pd
+import pyreadstat
+import pytest
+
+import tsapiness.connector_sav as cs
+import tsapiness.export as export
+
+
+@pytest.fixture
+def sav_file(tmp_path):
+    file = str(tmp_path / 'survey.sav')
+    frame = pd.DataFrame({'ID': [1.0, 2.0, 3.0, 4.0, 5.0],
+                          'DATE': [10.0, 11.0, 12.0, 13.0, 14.0],
+                          'Q1': [1.0, 2.0, None, 1.0, 2.0],
+                          'Q2': [20.0, None, 40.0, 50.0, 60.0]})
+    pyreadstat.write_sav(frame, file,
+                         column_labels=['id', 'date', 'gender', 'age'],
+                         variable_value_labels={'Q1': {1.0: 'Male',
+                                                       2.0: 'Female'}})
+    return file
+
+
+def _survey(sav_file, **kwargs):
+    return cs.Survey(connection=cs.Connection(sav_file), id_var='ID',
+                     date_var='DATE', **kwargs)
+
+
+def test_no_variables_gives_one_interview_per_row(sav_file):
+    interviews = _survey(sav_file, variables=[]).interviews
+
+    assert [iv.ident for iv in interviews] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert all(iv.data_items == [] for iv in interviews)
+
+
+def test_missing_values_have_no_data_item(sav_file):
+    interviews = _survey(sav_file).interviews
+
+    assert 'Q1' not in interviews[2]
+    assert interviews[2]['Q2'].values == [40.0]
+
+
+def test_columnar_in_chunks_matches_interviews(sav_file):
+    expected = [export.dumps(iv) for iv in _survey(sav_file).interviews]
+
+    columnar = _survey(sav_file, chunksize=2).get_columnar()
+
+    assert [export.dumps(iv) for iv in columnar] == expected
+
+
+def test_columnar_metadata_only_is_empty(sav_file):
+    assert len(_survey(sav_file, metadata_only=True).get_columnar()) == 0
+
+
+def test_label_ranges_do_not_load_the_data(sav_file):
+    survey = _survey(sav_file, ranges='labels')
+
+    q1 = survey.metadata.variable('Q1')
+
+    assert survey._data is None
+    assert q1.variable_values.range.to_tsapi() == {'from': 1.0, 'to': 2.0}
+
+
+def test_no_ranges_do_not_load_the_data(sav_file):
+    survey = _survey(sav_file, ranges=None)
+
+    q1 = survey.metadata.variable('Q1')
+
+    assert survey._data is None
+    assert q1.variable_values.range is None
+
+
+def test_data_ranges_by_default(sav_file):
+    survey = _survey(sav_file)
+
+    q2 = survey.metadata.variable('Q2')
+
+    assert q2.variable_values.range.to_tsapi() == {'from': 20.0, 'to': 60.0}
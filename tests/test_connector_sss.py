@@ -0,0 +1,137 @@
+import pytest
+
+import tsapiness.connector_sss as cs
+import tsapiness.export as export
+
+from conftest import ASC_FILE, make_sss_survey
+
+
+def _dumps(interviews) -> list:
+    return [export.dumps(iv) for iv in interviews]
+
+
+def _parallel(survey, chunk_size):
+    return cs.Interviews(file=survey.connection.asc_file,
+                         plan=survey.slicing_plan, workers=2,
+                         chunk_size=chunk_size)
+
+
+# every way of reading the interviews of an asc file
+MODES = {
+    'lines': lambda asc_file: make_sss_survey(asc_file).interviews,
+    'iterparse': lambda asc_file: make_sss_survey(
+        asc_file, iterparse=True).interviews,
+    'workers': lambda asc_file: make_sss_survey(
+        asc_file, workers=2).interviews,
+    'workers_small_chunks': lambda asc_file: _parallel(
+        make_sss_survey(asc_file), chunk_size=8),
+    'memory_map': lambda asc_file: make_sss_survey(
+        asc_file, memory_map=True).interviews,
+    'columnar': lambda asc_file: make_sss_survey(asc_file).get_columnar(
+        as_text=True),
+}
+
+
+@pytest.fixture(scope='module')
+def expected() -> list:
+    return _dumps(make_sss_survey().interviews)
+
+
+def test_lines_are_read_as_records(expected):
+    interviews = list(make_sss_survey().interviews)
+
+    assert [iv.ident for iv in interviews] == [1, 2, 3, 4, 5]
+    assert interviews[1]['1'].values == ['2']
+    assert interviews[1]['2'].values == ['02', '01', '  ']
+    assert len(expected) == 5
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_all_modes_read_the_same_interviews(mode, expected):
+    assert _dumps(MODES[mode](ASC_FILE)) == expected
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_interviews_are_re_iterable(mode, expected):
+    interviews = MODES[mode](ASC_FILE)
+
+    assert _dumps(interviews) == _dumps(interviews) == expected
+
+
+def _write_records(file, records: bytes, terminator: bytes) -> str:
+    with open(file, 'wb') as f:
+        f.write(records.replace(b'\n', terminator))
+    return str(file)
+
+
+@pytest.fixture
+def crlf_file(tmp_path) -> str:
+    with open(ASC_FILE, 'rb') as f:
+        records = f.read()
+    return _write_records(tmp_path / 'crlf.asc', records, b'\r\n')
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_crlf_file_reads_the_same(mode, crlf_file, expected):
+    assert _dumps(MODES[mode](crlf_file)) == expected
+
+
+@pytest.mark.parametrize('mode', sorted(set(MODES) - {'columnar'}))
+def test_crlf_short_lines_read_the_same(mode, tmp_path):
+    # trailing blanks trimmed, the last fields run past the end of the
+    # line and hold its line break
+    records = b'10101   33\n20201\n1\n20202   47\n'
+    lf_file = _write_records(tmp_path / 'lf.asc', records, b'\n')
+    crlf_file = _write_records(tmp_path / 'crlf.asc', records, b'\r\n')
+
+    assert _dumps(MODES[mode](crlf_file)) == \
+        _dumps(MODES['lines'](lf_file))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 8, 11, 12, 40, 1000])
+def test_chunks_end_on_line_breaks(chunk_size):
+    with open(ASC_FILE, 'rb') as f:
+        records = f.read()
+
+    chunks = cs._get_chunks(ASC_FILE, chunk_size)
+
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(records)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+        assert records[end - 1:end] == b'\n'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 8, 1000])
+def test_workers_keep_file_order(chunk_size, expected):
+    assert _dumps(_parallel(make_sss_survey(), chunk_size)) == expected
+
+
+def test_memory_map_cannot_use_workers():
+    with pytest.raises(ValueError):
+        iter(make_sss_survey(memory_map=True, workers=2).interviews)
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_variables_reads_only_those(mode):
+    variables = ['1', '3']
+    survey = make_sss_survey(variables=variables)
+    full = list(make_sss_survey().interviews)
+
+    if mode == 'workers_small_chunks':
+        interviews = _parallel(survey, chunk_size=8)
+    elif mode == 'columnar':
+        interviews = survey.get_columnar(as_text=True)
+    else:
+        survey = make_sss_survey(variables=variables,
+                                 memory_map=mode == 'memory_map',
+                                 iterparse=mode == 'iterparse',
+                                 workers=2 if mode == 'workers' else 1)
+        interviews = survey.interviews
+    interviews = list(interviews)
+
+    assert len(interviews) == len(full)
+    for iv, full_iv in zip(interviews, full):
+        assert [di.ident for di in iv.data_items] == variables
+        assert [di.values for di in iv.data_items] == \
+            [full_iv[ident].values for ident in variables]
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+
+import pytest
+import requests
+
+import tsapiness.connector_tsapi as ct
+import tsapiness.export as export
+import tsapiness.tsapi as ts
+
+from conftest import INTERVIEW_COUNT, INTERVIEWS, METADATA_ETAG
+
+
+def _survey(server, page_size=30, concurrency=4):
+    connection = ct.AsyncConnection(server=server.url,
+                                    concurrency=concurrency)
+    return ct.AsyncSurvey(survey_id='stub', connection=connection,
+                          page_size=page_size, date=None)
+
+
+def _posts(server) -> list:
+    return [entry for entry in server.log if entry[0] == 'POST']
+
+
+@pytest.mark.parametrize('page_size', [30, 50])
+def test_async_interviews_in_order(tsapi_server, page_size):
+    # 250 is not a multiple of 30, the last page is short. with 50 the
+    # pages end on an empty one
+    survey = _survey(tsapi_server, page_size=page_size)
+
+    idents = [iv.ident for iv in survey.interviews]
+
+    assert idents == [str(n) for n in range(1, INTERVIEW_COUNT + 1)]
+
+
+def test_async_for_in_order(tsapi_server):
+    survey = _survey(tsapi_server)
+
+    async def read():
+        return [iv.ident async for iv in survey.interviews]
+
+    idents = asyncio.run(read())
+
+    assert idents == [str(n) for n in range(1, INTERVIEW_COUNT + 1)]
+
+
+def test_short_page_stops_requests(tsapi_server):
+    page_size = 30
+    concurrency = 4
+    survey = _survey(tsapi_server, page_size=page_size,
+                     concurrency=concurrency)
+
+    list(survey.interviews)
+
+    # 9 pages hold the 250 interviews, at most one window of requests
+    # can be in flight past the short page
+    pages = -(-INTERVIEW_COUNT // page_size)
+    starts = [query['start'] for _, _, query in _posts(tsapi_server)]
+    assert len(starts) <= pages + concurrency
+    assert len(starts) == len(set(starts))
+
+
+def test_early_close_cancels_pages(tsapi_server):
+    concurrency = 4
+    survey = _survey(tsapi_server, page_size=10, concurrency=concurrency)
+
+    async def read_first():
+        pages = survey.interviews.__aiter__()
+        first = await pages.__anext__()
+        await pages.aclose()
+        return first
+
+    first = asyncio.run(read_first())
+
+    assert first.ident == '1'
+    # the first window and the page requested once the first page was
+    # read, nothing after the generator was closed
+    assert len(_posts(tsapi_server)) <= concurrency + 1
+
+
+def test_early_break_cancels_pages(tsapi_server):
+    concurrency = 4
+    survey = _survey(tsapi_server, page_size=10, concurrency=concurrency)
+
+    interviews = iter(survey.interviews)
+    first = next(interviews)
+    interviews.close()
+
+    assert first.ident == '1'
+    assert len(_posts(tsapi_server)) <= concurrency + 1
+
+
+def test_iter_json_array_any_chunk_boundary():
+    items = [1, 2.5, -3e-07, {'ident': '1', 'values': ['2']}, 'x', None, 7]
+    doc = json.dumps(items).encode('utf8')
+
+    for cut in range(len(doc)):
+        chunks = [doc[:cut], doc[cut:]]
+        assert list(ct.iter_json_array(chunks)) == items
+
+
+@pytest.mark.parametrize('doc', [b'[1,', b'[1', b'[', b'',
+                                 b'[{"ident": "1"}, {"ident"'])
+def test_iter_json_array_cut_off(doc):
+    for cut in range(len(doc) + 1):
+        with pytest.raises(ValueError, match='not complete'):
+            list(ct.iter_json_array([doc[:cut], doc[cut:]]))
+
+
+@pytest.mark.parametrize('doc', [b'[,,1]', b'[,]', b'[1,]', b'[1,,2]',
+                                 b'[1 2]'])
+def test_iter_json_array_stray_commas(doc):
+    for cut in range(len(doc) + 1):
+        with pytest.raises(ValueError, match='invalid'):
+            list(ct.iter_json_array([doc[:cut], doc[cut:]]))
+
+
+def test_second_sync_requests_only_new_interviews(tsapi_server, tsapi_survey,
+                                                  tmp_path, monkeypatch):
+    # blocks smaller than a line, the high water mark is read back
+    # across several of them
+    monkeypatch.setattr(ct, 'STORE_BLOCK_SIZE', 7)
+    file = str(tmp_path / 'store.ndjson')
+    survey = tsapi_survey()
+
+    assert survey.sync(ct.InterviewStore(file)) == INTERVIEW_COUNT
+    high_water_mark = max(iv['date'] for iv in INTERVIEWS)
+    posts = len(_posts(tsapi_server))
+
+    store = ct.InterviewStore(file)
+
+    assert store.high_water_mark == high_water_mark
+    assert survey.sync(store) == 0
+    queries = [query for _, _, query in _posts(tsapi_server)[posts:]]
+    assert queries
+    assert all(query['date'] == high_water_mark for query in queries)
+    assert [iv.ident for iv in store.interviews] == \
+        [iv['ident'] for iv in INTERVIEWS]
+
+
+def _stored_interview(ident, date, value):
+    return ts.Interview(ident=ident, date=date,
+                        dataItems=[{'ident': 'Q1', 'values': [value]}])
+
+
+def test_save_appends_only_merged_interviews(tmp_path):
+    file = str(tmp_path / 'store.ndjson')
+    store = ct.InterviewStore(file)
+    store.merge([_stored_interview('1', '2022-07-01', '1'),
+                 _stored_interview('2', '2022-07-02', '1')])
+    store.save()
+    with open(file, encoding='utf8') as f:
+        first_save = f.read()
+
+    store.merge([_stored_interview('1', '2022-07-03', '2')])
+    store.save()
+
+    with open(file, encoding='utf8') as f:
+        written = f.read()
+    assert written.startswith(first_save)
+    assert len(written[len(first_save):].splitlines()) == 2
+
+    reopened = ct.InterviewStore(file)
+    assert reopened.high_water_mark == '2022-07-03'
+    assert {iv.ident: iv['Q1'].values for iv in reopened.interviews} == \
+        {'1': ['2'], '2': ['1']}
+
+    reopened.compact()
+
+    with open(file, encoding='utf8') as f:
+        assert len(f.read().splitlines()) == 3
+    assert len(ct.InterviewStore(file)) == 2
+
+
+def test_failed_save_is_dropped(tmp_path):
+    file = str(tmp_path / 'store.ndjson')
+    store = ct.InterviewStore(file)
+    store.merge([_stored_interview('1', '2022-07-01', '1')])
+    store.save()
+    with open(file, 'a', encoding='utf8') as f:
+        # a save cut off half way through an interview
+        f.write('{"ident": "2", "date": "2022-07-05", "dataIt')
+
+    store = ct.InterviewStore(file)
+
+    assert store.high_water_mark == '2022-07-01'
+    assert len(store) == 1
+
+    store.merge([_stored_interview('2', '2022-07-02', '1')])
+    store.save()
+
+    reopened = ct.InterviewStore(file)
+    assert reopened.high_water_mark == '2022-07-02'
+    assert sorted(iv.ident for iv in reopened.interviews) == ['1', '2']
+
+
+def test_cached_survey_is_served_without_requests(tsapi_server, tsapi_survey,
+                                                  tmp_path):
+    cache = ct.ResponseCache(str(tmp_path / 'cache'), ttl=300)
+    survey = tsapi_survey(cache=cache)
+    expected = [export.dumps(iv) for iv in survey.interviews]
+    metadata = export.dumps(survey.metadata)
+    requests = len(tsapi_server.log)
+
+    cached = tsapi_survey(cache=cache)
+
+    assert [export.dumps(iv) for iv in cached.interviews] == expected
+    assert export.dumps(cached.metadata) == metadata
+    assert len(tsapi_server.log) == requests
+
+
+def test_stale_entry_is_revalidated(tsapi_server, tsapi_survey, tmp_path):
+    cache = ct.ResponseCache(str(tmp_path / 'cache'), ttl=0)
+    metadata = export.dumps(tsapi_survey(cache=cache).metadata)
+    key = cache.key('GET', f'{tsapi_server.url}/Surveys/stub/Metadata')
+    stored = cache.get(key)['stored']
+
+    revalidated = tsapi_survey(cache=cache).metadata
+
+    # the server answered 304, the cached body is used and the entry is
+    # refreshed
+    assert tsapi_server.log[-1] == ('GET', '/Surveys/stub/Metadata',
+                                    METADATA_ETAG)
+    assert export.dumps(revalidated) == metadata
+    assert cache.get(key)['stored'] > stored
+
+
+def _response(size) -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r.encoding = 'utf8'
+    r._content = b'x' * size
+    return r
+
+
+def _cache_size(directory) -> int:
+    return sum(os.path.getsize(os.path.join(directory, file))
+               for file in os.listdir(directory)
+               if file.endswith(ct.CACHE_SUFFIX))
+
+
+def test_cache_size_is_tracked_and_evicted(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = ct.ResponseCache(directory, max_size=20000)
+    # files of a store or anything else kept in the same directory
+    for other in ('store.json', 'notes.txt'):
+        with open(os.path.join(directory, other), 'w') as f:
+            f.write('x' * 5000)
+
+    size = 0
+    evictions = 0
+    for n in range(50):
+        cache.put(cache.key('GET', f'/{n}'), _response(1000))
+        assert cache._size == _cache_size(directory)
+        assert cache._size <= cache.max_size
+        if cache._size < size:
+            # trimmed to 90% of max_size whenever it went over
+            evictions += 1
+            assert cache._size <= cache.max_size * 0.9
+        size = cache._size
+
+    assert evictions
+    assert cache.get(cache.key('GET', '/49')) is not None
+    assert cache.get(cache.key('GET', '/0')) is None
+    for other in ('store.json', 'notes.txt'):
+        assert os.path.getsize(os.path.join(directory, other)) == 5000
@@ -0,0 +1,159 @@
+import copy
+import datetime
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+import tsapiness.connector_sss as cs
+import tsapiness.export as export
+import tsapiness.tsapi as ts
+
+from conftest import ASC_FILE, DATA, INTERVIEWS, METADATA, make_sss_survey
+
+
+def _numpy_interview() -> ts.Interview:
+    iv = ts.Interview(ident=np.int64(3),
+                      date=datetime.datetime(2022, 1, 2, 3, 4, 5))
+    iv.data_items = [ts.DataItem(ident='Q1', values=[np.float32(1.5),
+                                                     np.int64(2),
+                                                     np.bool_(True)])]
+    return iv
+
+
+def _numpy_metadata() -> ts.SurveyMetadata:
+    survey = ts.SurveyMetadata(name='S', title='T')
+    variable = ts.Variable(ident='Q1', label={'text': 'Q1'})
+    variable.variable_values.range = ts.ValueRange(
+        **{'from': np.float64(1), 'to': np.float64(4)})
+    survey.variables = [variable]
+    return survey
+
+
+def _nan_objects() -> tuple:
+    # value ranges of empty numeric sav columns are nan
+    survey = _numpy_metadata()
+    survey.variables[0].variable_values.range = ts.ValueRange(
+        **{'from': float('nan'), 'to': np.float32('nan')})
+    survey.variables[0].variable_values.values = [
+        ts.Value(ident='1', code=np.float32('nan'), label={'text': 'x'})]
+    interview = ts.Interview(ident='1', dataItems=[
+        {'ident': 'Q1', 'values': [float('inf'), np.float64('-inf')]}])
+    return survey, interview
+
+
+def _strict_loads(written: bytes):
+    def reject(constant):
+        raise ValueError(f'{constant} is not json')
+    return json.loads(written, parse_constant=reject)
+
+
+@pytest.mark.skipif(export.orjson is None, reason='orjson not installed')
+@pytest.mark.parametrize('obj', [_numpy_interview(), _numpy_metadata(),
+                                 *_nan_objects()])
+def test_encoders_write_the_same_json(obj):
+    from_orjson = _strict_loads(export._encode_orjson(obj))
+    from_json = _strict_loads(export._encode_json(obj))
+
+    assert from_orjson == from_json
+
+
+def test_nan_is_written_as_null():
+    metadata, interview = _nan_objects()
+
+    written = _strict_loads(export._encode_json(metadata))
+    variable_values = written['variables'][0]['values']
+    assert variable_values['range'] == {'from': None, 'to': None}
+    assert variable_values['values'][0]['code'] is None
+    assert _strict_loads(export._encode_json(interview))['dataItems'][0][
+        'values'] == [None, None]
+    # dumps stays identical to json.dumps
+    assert 'NaN' in export.dumps(metadata, default=export._default)
+
+
+def test_numpy_scalars_are_numbers():
+    written = json.loads(export.encode(_numpy_interview()))
+
+    assert written['ident'] == 3
+    assert written['date'] == '2022-01-02 03:04:05'
+    assert written['dataItems'][0]['values'] == [1.5, 2, True]
+
+
+# golden files: the json module's output for to_tsapi() of each object,
+# written once by running this module. the single pass encoder has to
+# reproduce them byte for byte
+
+GOLDEN = os.path.join(DATA, 'golden')
+
+
+def _metadata() -> ts.SurveyMetadata:
+    return ts.SurveyMetadata(**copy.deepcopy(METADATA))
+
+
+def _brand() -> ts.Variable:
+    return _metadata().variable('BRAND')
+
+
+def _mapped_interview() -> ts.Interview:
+    return next(iter(make_sss_survey(memory_map=True).interviews))
+
+
+def _record_interview() -> ts.Interview:
+    plan = make_sss_survey().slicing_plan
+    with open(ASC_FILE) as f:
+        records = np.array([plan.cut(f.readline())], dtype=plan.dtype)
+    return cs._record_interview(1, records[0], plan)
+
+
+GOLDEN_OBJECTS = {
+    'metadata': _metadata,
+    'loaded_metadata': lambda: ts.load_metadata(copy.deepcopy(METADATA)),
+    'variable': _brand,
+    'looped_variable': lambda: _brand().looped_variables[0],
+    'other_specify_variable': lambda: _brand().otherSpecifyVariables[0],
+    'interview': lambda: ts.Interview(**copy.deepcopy(INTERVIEWS[0])),
+    'lazy_interview': lambda: ts.load_interview(
+        copy.deepcopy(INTERVIEWS[0]), lazy=True),
+    'mapped_interview': _mapped_interview,
+    'record_interview': _record_interview,
+    'sss_metadata': lambda: make_sss_survey().metadata.survey,
+}
+
+
+def _golden_file(name, ensure_ascii) -> str:
+    suffix = 'ascii' if ensure_ascii else 'utf8'
+    return os.path.join(GOLDEN, f'{name}.{suffix}.json')
+
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+@pytest.mark.parametrize('name', sorted(GOLDEN_OBJECTS))
+def test_dumps_matches_golden(name, ensure_ascii):
+    obj = GOLDEN_OBJECTS[name]()
+    with open(_golden_file(name, ensure_ascii), encoding='utf8') as f:
+        golden = f.read()
+
+    assert export.dumps(obj, ensure_ascii=ensure_ascii) == golden
+    assert json.dumps(obj.to_tsapi(), ensure_ascii=ensure_ascii) == golden
+
+
+@pytest.mark.parametrize('name', sorted(GOLDEN_OBJECTS))
+def test_dump_matches_golden(name):
+    obj = GOLDEN_OBJECTS[name]()
+    with open(_golden_file(name, False), encoding='utf8') as f:
+        golden = f.read()
+
+    out = io.StringIO()
+    export.dump(obj, out, ensure_ascii=False)
+
+    assert out.getvalue() == golden
+
+
+if __name__ == '__main__':
+    for golden_name, make in GOLDEN_OBJECTS.items():
+        for ascii_only in (True, False):
+            with open(_golden_file(golden_name, ascii_only), 'w',
+                      encoding='utf8') as golden_f:
+                golden_f.write(json.dumps(make().to_tsapi(),
+                                          ensure_ascii=ascii_only))
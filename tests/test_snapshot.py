@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+import tsapiness.export as export
+import tsapiness.snapshot as snapshot
+
+from conftest import INTERVIEW_COUNT
+
+
+def test_tsapi_round_trip_with_looped_variables(tsapi_server, tsapi_survey,
+                                                 tmp_path):
+    directory = str(tmp_path / 'stub')
+    survey = tsapi_survey()
+
+    assert survey.save_snapshot(directory) == INTERVIEW_COUNT
+    requests = len(tsapi_server.log)
+    reopened = tsapi_survey().load_snapshot(directory)
+
+    assert len(tsapi_server.log) == requests
+    assert export.dumps(reopened.metadata) == export.dumps(survey.metadata)
+    assert reopened.metadata.variable('RATING').parent_variable_ident == \
+        'BRAND'
+    assert reopened.metadata.variable('RATING').parent_value_ident == 'A'
+    assert [export.dumps(iv) for iv in reopened.interviews] == \
+        [export.dumps(iv) for iv in survey.interviews]
+
+
+def test_sss_round_trip_keeps_the_field_text(sss_survey, tmp_path):
+    directory = str(tmp_path / 'sss')
+    survey = sss_survey()
+
+    survey.save_snapshot(directory)
+    reopened = sss_survey().load_snapshot(directory)
+
+    assert [export.dumps(iv) for iv in reopened.interviews] == \
+        [export.dumps(iv) for iv in survey.interviews]
+    assert all(isinstance(column, np.memmap)
+               for column in reopened.interviews.columns.values())
+
+
+def test_save_replaces_a_snapshot(sss_survey, tmp_path):
+    directory = str(tmp_path / 'sss')
+    sss_survey().save_snapshot(directory)
+
+    # a trailing separator names the same directory
+    sss_survey().save_snapshot(directory + os.sep)
+
+    assert sorted(os.listdir(tmp_path)) == ['sss']
+    assert snapshot.is_snapshot(directory)
+
+
+def test_save_refuses_other_directories(sss_survey, tmp_path):
+    directory = tmp_path / 'other'
+    directory.mkdir()
+    (directory / 'important.txt').write_text('keep me')
+
+    with pytest.raises(FileExistsError):
+        sss_survey().save_snapshot(str(directory))
+
+    assert (directory / 'important.txt').read_text() == 'keep me'
+    assert sorted(os.listdir(tmp_path)) == ['other']
+
+
+@pytest.mark.parametrize('records', [
+    '10101   33\n20201\n10101   21\n2\n20202   47\n',
+    # the file size is a multiple of the first record's length
+    '10101   33\n1010\n2020200000000000\n'])
+def test_sss_ragged_records_are_saved(sss_survey, tmp_path, records):
+    # trailing blanks trimmed, the records are not all the same length
+    asc_file = tmp_path / 'ragged.asc'
+    asc_file.write_text(records)
+    survey = sss_survey(asc_file=str(asc_file))
+    directory = str(tmp_path / 'sss')
+
+    with pytest.raises(ValueError):
+        survey.get_columns()
+    assert survey.save_snapshot(directory) == records.count('\n')
+
+    reopened = sss_survey().load_snapshot(directory)
+    assert [export.dumps(iv) for iv in reopened.interviews] == \
+        [export.dumps(iv) for iv in survey.interviews]
@@ -0,0 +1,103 @@
+import copy
+
+import pytest
+
+import tsapiness.export as export
+import tsapiness.tsapi as ts
+
+from conftest import INTERVIEW_COUNT, METADATA
+
+
+def test_columnar_keeps_looped_data_items(tsapi_survey):
+    survey = tsapi_survey()
+
+    columnar = survey.get_columnar()
+
+    expected = [export.dumps(iv) for iv in survey.interviews]
+    assert len(columnar) == INTERVIEW_COUNT
+    assert [export.dumps(iv) for iv in columnar] == expected
+
+
+def test_columnar_keeps_hierarchical_interviews():
+    interview = ts.Interview(
+        ident='1',
+        dataItems=[{'ident': 'Q1', 'values': ['1']}],
+        hierarchicalInterviews=[{'level': {'ident': 'L'}, 'ident': 'h1',
+                                 'date': '', 'dataItems': []}])
+
+    columnar = ts.ColumnarInterviews.from_interviews([interview])
+
+    assert export.dumps(next(iter(columnar))) == export.dumps(interview)
+
+
+def test_columnar_rejects_repeated_idents():
+    interviews = [ts.Interview(ident=str(n), dataItems=[
+        {'ident': 'Q', 'values': [value]} for value in values])
+        for n, values in enumerate([['a', 'b'], ['c'], ['d']])]
+
+    with pytest.raises(ValueError):
+        ts.ColumnarInterviews.from_interviews(interviews)
+
+
+def test_interview_index_follows_data_items():
+    interview = ts.Interview(ident='1', dataItems=[
+        {'ident': 'Q1', 'values': ['1']}, {'ident': 'Q2', 'values': ['2']}])
+    assert 'Q1' in interview
+
+    interview.data_items.append(ts.DataItem(ident='Q3', values=['3']))
+    assert interview['Q3'].values == ['3']
+
+    interview.data_items[0] = ts.DataItem(ident='Q9', values=['9'])
+    interview.invalidate_index()
+    assert 'Q9' in interview
+    assert 'Q1' not in interview
+
+
+def test_interview_iterates_its_data_items():
+    interview = ts.Interview(ident='1', dataItems=[
+        {'ident': 'Q1', 'values': ['1']}, {'ident': 'Q2', 'values': ['2']}])
+    lazy = ts.load_interview(interview.to_tsapi(), lazy=True)
+
+    assert list(interview) == interview.data_items
+    assert [di.ident for di in lazy] == ['Q1', 'Q2']
+
+
+def test_variable_and_label_invalidate_index():
+    variable = ts.Variable(
+        ident='Q1',
+        label={'text': 'Q1', 'altLabels': [{'mode': 'analysis',
+                                           'text': 'Gender'}]},
+        values={'values': [{'ident': 'M', 'code': '1',
+                            'label': {'text': 'Male'}}]})
+    assert variable.value('1').ident == 'M'
+    assert variable.label.alt_label_text('analysis') == 'Gender'
+
+    variable.values[0] = ts.Value(ident='F', code='2',
+                                  label={'text': 'Female'})
+    variable.invalidate_index()
+    variable.label.alt_labels[0].text = 'Sex'
+    variable.label.invalidate_index()
+
+    assert variable.value('2').ident == 'F'
+    with pytest.raises(KeyError):
+        variable.value('1')
+    assert variable.label.alt_label_text('analysis') == 'Sex'
+
+
+def test_flat_table_matches_flatten_variable():
+    metadata = ts.SurveyMetadata(**copy.deepcopy(METADATA))
+    expected = [row for variable in metadata.variables
+                for row in ts.flatten_variable(variable, [])]
+
+    assert metadata.flat_table() == expected
+    assert metadata.flat_table(as_dataframe=True).shape[0] == len(expected)
+
+
+def test_flat_table_after_in_place_edit():
+    metadata = ts.SurveyMetadata(**copy.deepcopy(METADATA))
+    metadata.flat_table()
+
+    metadata.variable('Q2').ident = 'AGE'
+    metadata.invalidate_index()
+
+    assert 'AGE' in {row['variable_ident'] for row in metadata.flat_table()}